@@ -0,0 +1,38 @@
+import hmac
+import os
+
+import streamlit as st
+
+
+def admin_password():
+    """ADMIN_PASSWORD from the environment or st.secrets, or None"""
+    password = os.getenv('ADMIN_PASSWORD')
+    if password:
+        return password
+    try:
+        return st.secrets.get('ADMIN_PASSWORD')
+    except FileNotFoundError:
+        # no secrets.toml
+        return None
+
+
+def require_admin():
+    """Stop the page unless this session has entered the admin password
+
+    The admin pages show every user's questions and sessions, and pages/ is
+    listed for everyone, so they stay disabled until ADMIN_PASSWORD is set.
+    """
+    password = admin_password()
+    if not password:
+        st.warning("Admin pages are disabled. Set ADMIN_PASSWORD to enable them.")
+        st.stop()
+    if st.session_state.get('admin'):
+        return
+    entered = st.text_input("Admin password", type="password")
+    if not entered:
+        st.stop()
+    if not hmac.compare_digest(entered.encode(), password.encode()):
+        st.error("Wrong password")
+        st.stop()
+    st.session_state.admin = True
+    st.rerun()
@@ -0,0 +1,104 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from bm25 import citation_terms
+
+ANSWER_CACHE_THRESHOLD = 0.95
+# ada-002 similarities crowd the top of the range, so it needs a stricter cut;
+# ANSWER_CACHE_THRESHOLD in the environment overrides every backend
+ANSWER_CACHE_THRESHOLDS = {'text-embedding-ada-002': 0.97}
+ANSWER_CACHE_TTL = 24 * 3600
+ANSWER_CACHE_MAX_ENTRIES = 1000
+
+
+def threshold_for(embedding_identity):
+    if os.getenv('ANSWER_CACHE_THRESHOLD'):
+        return float(os.getenv('ANSWER_CACHE_THRESHOLD'))
+    return ANSWER_CACHE_THRESHOLDS.get(embedding_identity, ANSWER_CACHE_THRESHOLD)
+
+
+def normalize_question(question):
+    """Lower-case, collapse whitespace and drop trailing punctuation"""
+    question = re.sub(r'\s+', ' ', question.strip().lower())
+    return question.rstrip(' ?.!')
+
+
+class SemanticAnswerCache:
+    """Process-wide cache of first-turn answers looked up by question similarity
+
+    Entries live in a namespace, e.g. (index version, student type, model), and
+    a lookup returns the stored answer whose question embedding is closest to
+    the new one if the cosine similarity reaches the threshold and both
+    questions cite exactly the same sections (e.g. 300.322 never matches
+    300.324, however close the embeddings). Entries expire
+    after ttl seconds; beyond max_entries the least recently used are dropped.
+    """
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _citations(question):
+        return frozenset(citation_terms(question))
+
+    def lookup(self, namespace, vector, question):
+        """Return the cached answer for a similar question, or None"""
+        query = self._unit(vector)
+        citations = self._citations(question)
+        now = time.time()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if now - entry['created'] > self.ttl]
+            for key in expired:
+                del self._entries[key]
+            candidates = [(key, entry) for key, entry in self._entries.items()
+                          if entry['namespace'] == namespace and entry['citations'] == citations]
+            if candidates:
+                similarities = np.stack([entry['vector'] for _, entry in candidates]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    key, entry = candidates[best]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry['answer']
+            self.misses += 1
+            return None
+
+    def store(self, namespace, vector, question, answer):
+        with self._lock:
+            self._entries[self._next_id] = {
+                'namespace': namespace,
+                'vector': self._unit(vector),
+                'citations': self._citations(question),
+                'answer': answer,
+                'created': time.time(),
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -1,5 +1,8 @@
 import streamlit as st
 import os
+import time
+import uuid
+from collections import Counter
 
 # Try to import dotenv, but don't fail if it's not available
 try:
@@ -23,135 +26,386 @@ HUGGINGFACE_API_KEY = os.getenv('HUGGINGFACE_API_KEY')
 
 # Import dependencies with error handling
 try:
-    from PyPDF2 import PdfReader
+    from pdf_extract import iter_pdf_pages, slowest_pages
     PDF_AVAILABLE = True
 except ImportError:
     PDF_AVAILABLE = False
     st.error("PyPDF2 is not installed. Please check requirements.txt")
 
 try:
-    from langchain_community.document_loaders import PyPDFLoader, DirectoryLoader
-    from langchain.text_splitter import RecursiveCharacterTextSplitter, CharacterTextSplitter
-    from langchain_community.embeddings import OpenAIEmbeddings
-    from langchain_community.vectorstores import FAISS
-    from langchain_community.chat_models import ChatOpenAI
-    from langchain_community.callbacks.manager import get_openai_callback
-    from langchain.chains import LLMChain
-    from langchain.chains.question_answering import load_qa_chain
-    from langchain.memory import ConversationBufferMemory
-    from langchain.memory.vectorstore import VectorStoreRetrieverMemory
-    from langchain.chains import ConversationalRetrievalChain, RetrievalQA
-    from langchain_core.prompts import PromptTemplate
-    from langchain.prompts.chat import SystemMessagePromptTemplate
-    LANGCHAIN_AVAILABLE = True
+    # LangChain and FAISS take seconds to import, so they are imported where
+    # they are first used and warmed in the background once the page is up
+    from lazy_imports import installed, preload, import_report
+    LANGCHAIN_AVAILABLE = installed('langchain', 'langchain_community', 'langchain_core', 'faiss')
+    if not LANGCHAIN_AVAILABLE:
+        st.error("LangChain dependencies not available. Please check requirements.txt")
 except ImportError as e:
     LANGCHAIN_AVAILABLE = False
     st.error(f"LangChain dependencies not available: {e}")
 
+# stdlib only, so it imports even when the local modules below do not; read
+# after load_dotenv so .env can set SESSION_IDLE_SECONDS
+from session_store import SESSION_IDLE_SECONDS
+
 try:
     from htmlTempletes import css, bot_template, user_template
-    from questionmaker import NoOpLLMChain
-    from prompts import general_prompt, general_citation, engagedlow_student_prompt, engagedchild_student_prompt
+    import index_cache
+    from chunking import CHUNK_SIZE, CHUNK_OVERLAP, CHUNKER_VERSION, iter_chunks, to_documents
+    from request_queue import RequestQueue
+    from llm_client import get_openai_client
+    from answer_cache import SemanticAnswerCache, normalize_question, threshold_for
+    from retrieval_cache import RetrievalCache
+    from tracing import TraceStore, traced
+    from chat_render import HISTORY_PAGE_SIZE, history_html, render_message
+    from session_store import approx_size, get_chat_log, get_session_store
+    # read-only corpus index built offline with `python -m ingest` and shared by every session
+    from ingest import DEFAULT_INDEX_DIR as SHARED_INDEX_DIR
     LOCAL_MODULES_AVAILABLE = True
 except ImportError as e:
     LOCAL_MODULES_AVAILABLE = False
     st.error(f"Local modules not available: {e}")
 
-def get_pdf_text(pdf_docs):
+# hybrid vector + BM25 retrieval is precise enough to fetch far fewer chunks;
+# citation answers carry their sources in chunk metadata, so need fewer still
+RETRIEVER_K = {'General with citation': 8}
+DEFAULT_RETRIEVER_K = 15
+# tokens of retrieved context sent per question, on top of the system prompt and history
+CONTEXT_TOKEN_BUDGET = {'GPT-4o mini': 6000, 'OpenAI GPT 3.5': 2500}
+# turns of chat history sent verbatim by the bounded memory modes
+MEMORY_TURNS = 5
+# share one in-flight answer between sessions asking the same first question
+COALESCE_ACROSS_SESSIONS = os.getenv('COALESCE_ACROSS_SESSIONS', '').lower() in ('1', 'true', 'yes')
+# how often the script thread redraws a streaming answer
+POLL_INTERVAL = 0.1
+# uploaded indexes held in memory at once, shared by sessions that uploaded the same files
+OVERLAY_CACHE_ENTRIES = int(os.getenv('OVERLAY_CACHE_ENTRIES', '8'))
+# uploaded indexes no session has used for an idle timeout are dropped
+OVERLAY_CACHE_TTL = SESSION_IDLE_SECONDS
+
+def get_pdf_text(pdf_docs, page_timings=None):
     if not PDF_AVAILABLE:
         st.error("PDF processing not available")
-        return ""
+        return
     
-    text = ""
-    for pdf in pdf_docs:
-        pdf_reader = PdfReader(pdf)
-        for page in pdf_reader.pages:
-            text += page.extract_text()
-    return text
-
-def get_text_chunks(text):
+    # pages are extracted in parallel and streamed back in order
+    for page in iter_pdf_pages(pdf_docs):
+        if page_timings is not None:
+            page_timings.append(page._replace(text=None))
+        yield page
+
+def get_text_chunks(pages):
     if not LANGCHAIN_AVAILABLE:
         st.error("Text processing not available")
         return []
     
-    text_splitter = CharacterTextSplitter(
-        separator="\n",
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len
-    )
-    chunks = text_splitter.split_text(text)
-    return chunks
+    # chunks keep their source file, page range and section heading
+    return to_documents(iter_chunks(pages, CHUNK_SIZE, CHUNK_OVERLAP))
+
+def get_embeddings():
+    from embedding_backends import EMBEDDING_BACKEND, get_embeddings as get_backend_embeddings
+
+    # EMBEDDING_BACKEND=local embeds on this machine's CPUs without an API key
+    if EMBEDDING_BACKEND == 'openai' and not OPENAI_API_KEY:
+        st.error('OpenAI API key not configured for embeddings', icon="🚨")
+        return None
+    # Chunks embedded by earlier runs are served from the local embedding cache
+    return get_backend_embeddings(EMBEDDING_BACKEND)
+
+def get_index_key(pdf_docs):
+    from embedding_backends import EMBEDDING_BACKEND, embedding_identity
+    from faiss_index import INDEX_TYPE
 
-def get_vectorstore(text_chunks):
+    # chunk ids and citations carry the file names, so the same bytes under
+    # another name are a different index
+    files = sorted((pdf.name, index_cache.file_hash(pdf)) for pdf in pdf_docs)
+    return index_cache.index_key(pdf_docs, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                                 chunker=CHUNKER_VERSION, embeddings=embedding_identity(EMBEDDING_BACKEND),
+                                 index_type=INDEX_TYPE, ids='per-file', files=files)
+
+def get_cached_vectorstore(index_key, mmap=True):
+    if not LANGCHAIN_AVAILABLE or not LOCAL_MODULES_AVAILABLE:
+        return None
+    embeddings = get_embeddings()
+    if embeddings is None:
+        return None
+    try:
+        return index_cache.load_index(index_key, embeddings, mmap=mmap)
+    except Exception as e:
+        st.warning(f"Could not load cached index, rebuilding: {e}")
+        return None
+
+def file_chunk_counts(vectorstore):
+    # uploads are indexed with ids "<file name>#<n>", see ingest.chunk_ids
+    return Counter(doc_id.rsplit('#', 1)[0] for doc_id in vectorstore.index_to_docstore_id.values())
+
+def update_vectorstore(pdf_docs, index_key):
+    """Edit the session's uploaded-documents index to match pdf_docs and save it under index_key
+
+    Only files added or changed since the last Process are extracted and
+    embedded; chunks of removed or changed files are deleted by id. Returns
+    the new {file name: {'sha256', 'chunks'}} table, or None on failure.
+    """
     if not LANGCHAIN_AVAILABLE:
         st.error("Vector store not available")
         return None
+    from langchain_community.vectorstores import FAISS
+    from faiss_index import INDEX_TYPE, convert, resolve_index_type, to_flat
+    from ingest import chunk_ids, split_by_source
     
-    # Use OpenAI embeddings instead of HuggingFace for lighter deployment
-    if not OPENAI_API_KEY:
-        st.error('OpenAI API key not configured for embeddings', icon="🚨")
+    embeddings = get_embeddings()
+    if embeddings is None:
         return None
     
+    uploads = {pdf.name: (index_cache.file_hash(pdf), pdf) for pdf in pdf_docs}
+    files = dict(st.session_state.uploaded_files)
+    removed = [name for name, entry in files.items() if uploads.get(name, (None,))[0] != entry['sha256']]
+    vectorstore = None
+    if st.session_state.overlay_key is not None and len(removed) < len(files):
+        # a private copy, as the cached index may be serving other sessions;
+        # chunks are only removed and added exactly on a flat index
+        vectorstore = get_cached_vectorstore(st.session_state.overlay_key, mmap=False)
+        if vectorstore is not None:
+            vectorstore = to_flat(vectorstore, embeddings)
+            # count this run's embedding cache hits and misses
+            vectorstore.embedding_function = embeddings
+    if vectorstore is None:
+        # nothing to build on, so every upload is indexed
+        files, removed = {}, []
+    added = [name for name, (digest, _) in uploads.items() if files.get(name, {}).get('sha256') != digest]
+    
+    try:
+        for name in removed:
+            ids = chunk_ids(name, files.pop(name)['chunks'])
+            if ids:
+                vectorstore.delete(ids)
+        page_timings = []
+        # the added files are extracted in one pass, so their pages share the process pool
+        text_chunks = get_text_chunks(get_pdf_text([uploads[name][1] for name in added], page_timings)) if added else []
+        documents, ids = [], []
+        for name, (docs, doc_ids) in split_by_source(text_chunks, added).items():
+            documents.extend(docs)
+            ids.extend(doc_ids)
+            files[name] = {'sha256': uploads[name][0], 'chunks': len(docs)}
+        if documents:
+            if vectorstore is None:
+                # Use FAISS instead of ChromaDB for better Streamlit Cloud compatibility
+                vectorstore = FAISS.from_documents(documents=documents, embedding=embeddings, ids=ids)
+            else:
+                vectorstore.add_documents(documents, ids=ids)
+        if vectorstore is None or vectorstore.index.ntotal == 0:
+            st.error("No text could be extracted from the uploaded PDFs")
+            return None
+        # large uploads are compressed; typical ones stay exact
+        vectorstore = convert(vectorstore, resolve_index_type(INDEX_TYPE, vectorstore.index.ntotal))
+    except Exception as e:
+        st.error(f"Failed to update vector store: {e}")
+        return None
+    if page_timings:
+        with st.expander("Slowest pages"):
+            for page in slowest_pages(page_timings):
+                st.write(f"{page.source} p.{page.page_no}: {page.seconds:.2f}s")
+    st.caption(f"{len(added)} files indexed, {len(removed)} removed; "
+               f"embedding cache: {embeddings.hits} hits, {embeddings.misses} misses")
+    
     try:
-        embeddings = OpenAIEmbeddings()
-        # Use FAISS instead of ChromaDB for better Streamlit Cloud compatibility
-        vectorstore = FAISS.from_texts(texts=text_chunks, embedding=embeddings)
-        return vectorstore
+        index_cache.save_index(index_key, vectorstore, embeddings)
     except Exception as e:
-        st.error(f"Failed to create vector store: {e}")
+        st.error(f"Could not cache vector store: {e}")
         return None
+    return files
+
+@st.cache_resource(show_spinner="Loading shared corpus...")
+def load_shared_index():
+    # loaded once per process; sessions only ever search it
+    if not LANGCHAIN_AVAILABLE or not os.path.isdir(SHARED_INDEX_DIR):
+        return None
+    from embedding_backends import check_index_metadata
+    from faiss_index import load_vectorstore
+    from retrieval import keyword_index
+
+    embeddings = get_embeddings()
+    if embeddings is None:
+        return None
+    try:
+        check_index_metadata(SHARED_INDEX_DIR, embeddings)
+        # memory-mapped where the index type allows, so replicas share the page cache
+        vectorstore = load_vectorstore(SHARED_INDEX_DIR, embeddings)
+        # older indexes have no saved BM25 index; build it here rather than on the first question
+        keyword_index(vectorstore)
+    except Exception as e:
+        st.warning(f"Could not load shared corpus index: {e}")
+        return None
+    get_session_store().mark_shared(vectorstore)
+    return vectorstore
+
+@st.cache_resource(max_entries=OVERLAY_CACHE_ENTRIES, ttl=OVERLAY_CACHE_TTL, show_spinner=False)
+def get_overlay_index(index_key):
+    # sessions keep only the key of their uploads' index; the index itself is
+    # read back from the on-disk index cache into this small LRU
+    vectorstore = get_cached_vectorstore(index_key)
+    get_session_store().mark_shared(vectorstore)
+    return vectorstore
+
+def get_session_vectorstores(shared_index):
+    overlay = None
+    if st.session_state.overlay_key is not None:
+        overlay = get_overlay_index(st.session_state.overlay_key)
+        if overlay is None:
+            get_overlay_index.clear(st.session_state.overlay_key)
+            st.warning("Your uploaded documents are no longer cached. Please process them again.")
+            st.session_state.overlay_key = None
+            st.session_state.index_version = get_shared_index_version() if shared_index is not None else None
+    return [vs for vs in [shared_index, overlay] if vs is not None]
+
+def get_shared_index_version():
+    index_file = os.path.join(SHARED_INDEX_DIR, 'index.faiss')
+    if not os.path.isfile(index_file):
+        return None
+    return f"shared-{os.path.getmtime(index_file):.0f}"
+
+@st.cache_resource
+def get_answer_cache():
+    # one cache per process so every session benefits from repeated questions
+    from embedding_backends import EMBEDDING_BACKEND, embedding_identity
+
+    return SemanticAnswerCache(threshold=threshold_for(embedding_identity(EMBEDDING_BACKEND)))
+
+@st.cache_resource
+def get_retrieval_cache():
+    # query embeddings and retrieved chunks, shared by sessions on the same indexes
+    cache = RetrievalCache()
+    get_session_store().mark_shared(cache)
+    return cache
+
+MODEL_NAMES = {'OpenAI GPT 3.5': "gpt-3.5-turbo", 'GPT-4o mini': "gpt-4o-mini"}
+
+@st.cache_resource
+def get_llm(model_name, streaming=True):
+    from langchain_community.chat_models import ChatOpenAI
+
+    # every session shares one connection pool, rate limiter and retry policy
+    llm = ChatOpenAI(model=model_name, temperature=0, streaming=streaming,
+                     client=get_openai_client().chat.completions)
+    get_session_store().mark_shared(llm)
+    return llm
 
-def get_conversation_chain(vectorstore, model, student_type):
+@st.cache_resource
+def get_chain_skeleton(model_name, student_type):
+    # prompt parsing and chain construction happen once per process, not per session
+    from chains import build_answer_chain
+
+    skeleton = build_answer_chain(get_llm(model_name), student_type)
+    get_session_store().mark_shared(*skeleton)
+    return skeleton
+
+def get_memory(memory_mode, model_name):
+    from langchain.memory import ConversationBufferMemory, ConversationBufferWindowMemory
+    from bounded_memory import TurnWindowSummaryMemory
+
+    if memory_mode == 'Full history':
+        return ConversationBufferMemory(memory_key='chat_history', output_key='answer', return_messages=True)
+    if memory_mode == f'Last {MEMORY_TURNS} turns':
+        return ConversationBufferWindowMemory(k=MEMORY_TURNS, memory_key='chat_history', output_key='answer',
+                                              return_messages=True)
+    # older turns are summarised by a non-streaming copy of the model
+    return TurnWindowSummaryMemory(llm=get_llm(model_name, streaming=False), max_turns=MEMORY_TURNS,
+                                   memory_key='chat_history', output_key='answer', return_messages=True)
+
+def get_conversation_chain(vectorstores, model, student_type, memory):
     if not LANGCHAIN_AVAILABLE or not LOCAL_MODULES_AVAILABLE:
         st.error("Conversation chain not available")
         return None
     
     # Simplified model selection - use only OpenAI for production
-    if model == 'OpenAI GPT 3.5': 
-        if not OPENAI_API_KEY:
-            st.error('OpenAI API key not configured', icon="🚨")
-            return None
-        llm = ChatOpenAI(temperature=0)
-    elif model == 'GPT-4o mini': 
-        if not OPENAI_API_KEY:
-            st.error('OpenAI API key not configured', icon="🚨")
-            return None
-        llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-    else:
+    model_name = MODEL_NAMES.get(model)
+    if model_name is None:
         st.error('Only OpenAI models are supported in production deployment', icon="🚨")
         return None
+    if not OPENAI_API_KEY:
+        st.error('OpenAI API key not configured', icon="🚨")
+        return None
+    try:
+        from chains import build_conversation_chain
+        from retrieval import MergedRetriever, score_threshold_for
+    except ImportError as e:
+        st.error(f"Conversation chain not available: {e}")
+        return None
+    
+    embeddings = get_embeddings()
+    if embeddings is None:
+        return None
+    get_session_store().mark_shared(embeddings)
     
     try:
-        #create memory type
-        memory = ConversationBufferMemory(memory_key='chat_history', output_key='answer', return_messages=True)
-        #create conversation chain
-        conv_rqa = ConversationalRetrievalChain.from_llm(llm=llm,
-                                                    chain_type="stuff",
-                                                    verbose="False",
-                                                    memory = memory,
-                                                    retriever=vectorstore.as_retriever(search_type="similarity_score_threshold",search_kwargs={'k': 30, 'score_threshold': 0.42}),
-                                                    return_source_documents = True)
-        no_op_chain = NoOpLLMChain(llm=llm)
-        conv_rqa.question_generator = no_op_chain
-        if student_type == 'General':
-            modified_template = general_prompt()
-        elif student_type == 'General with citation':
-            modified_template = general_citation()
-        elif student_type == 'Engaged Low':
-            modified_template = engagedlow_student_prompt()
-        elif student_type == 'Engaged Child':
-            modified_template = engagedchild_student_prompt()
-        system_message_prompt = SystemMessagePromptTemplate.from_template(modified_template)
-        conv_rqa.combine_docs_chain.llm_chain.prompt.messages[0] = system_message_prompt
-        # add chat_history as a variable to the llm_chain's ChatPromptTemplate object
-        conv_rqa.combine_docs_chain.llm_chain.prompt.input_variables = ['context', 'question', 'chat_history']
-
-        return conv_rqa
+        #search the shared corpus together with this session's uploads
+        retriever = MergedRetriever(vectorstores=[vs for vs in vectorstores if vs is not None],
+                                    embeddings=embeddings,
+                                    k=RETRIEVER_K.get(student_type, DEFAULT_RETRIEVER_K),
+                                    score_threshold=score_threshold_for(embeddings.model_name),
+                                    token_budget=CONTEXT_TOKEN_BUDGET[model],
+                                    model_name=model_name,
+                                    cache=get_retrieval_cache(),
+                                    cache_namespace=st.session_state.index_version)
+        #attach this session's retriever and memory to the shared chain skeleton
+        return build_conversation_chain(get_chain_skeleton(model_name, student_type), retriever, memory)
     except Exception as e:
         st.error(f"Failed to create conversation chain: {e}")
         return None
 
+def get_session_objects():
+    # the chain and memory live outside st.session_state and are dropped once the session goes idle
+    return get_session_store().objects(st.session_state.session_id)
+
+def get_full_history():
+    history = st.session_state.chat_history
+    if st.session_state.history_total > len(history):
+        history = get_chat_log().tail(st.session_state.session_id, st.session_state.history_total)
+    return history
+
+def append_history(*messages):
+    get_chat_log().append(st.session_state.session_id, messages)
+    history = st.session_state.chat_history
+    history.extend(messages)
+    st.session_state.history_total += len(messages)
+    # only the newest page stays in session state; older pages are read back from the chat log
+    excess = len(history) - HISTORY_PAGE_SIZE
+    if excess > 0:
+        del history[:excess]
+        del st.session_state.rendered_history[:excess]
+
+def sync_conversation(model, student_type, memory_mode, shared_index):
+    """Point the session's chain at the selected settings, keeping its indexes and memory
+
+    Also rebuilds the chain and memory from the chat log after an idle eviction.
+    """
+    if shared_index is None and st.session_state.overlay_key is None:
+        return
+    objects = get_session_objects()
+    rebuild = objects.get('conversation') is None or st.session_state.chain_settings != (model, student_type)
+    if objects.get('memory') is None or st.session_state.memory_mode != memory_mode:
+        memory = get_memory(memory_mode, MODEL_NAMES.get(model))
+        # a new memory starts from the conversation so far
+        history = get_full_history()
+        turns = [(question['content'], answer['content']) for question, answer in zip(history[::2], history[1::2])]
+        if hasattr(memory, 'load_turns'):
+            memory.load_turns(turns)
+        else:
+            for question, answer in turns:
+                memory.save_context({'question': question}, {'answer': answer})
+        objects['memory'] = memory
+        st.session_state.memory_mode = memory_mode
+        rebuild = True
+    if not rebuild:
+        return
+    vectorstores = get_session_vectorstores(shared_index)
+    if not vectorstores:
+        return
+    conversation = get_conversation_chain(vectorstores, model, student_type, objects['memory'])
+    if conversation is not None:
+        objects['conversation'] = conversation
+        st.session_state.chain_settings = (model, student_type)
+        st.session_state.answer_namespace = (st.session_state.index_version, student_type, model)
+
 def select_model():
     # Simplified model selection for production - only OpenAI models
     if not OPENAI_API_KEY:
@@ -172,24 +426,162 @@ def select_student_type():
     ('General', 'General with citation', 'Engaged Low', 'Engaged Child'))
     return student_type
 
+def render_chat_history():
+    messages = st.session_state.chat_history
+    visible = st.session_state.history_visible
+    hidden = max(0, st.session_state.history_total - visible)
+    if hidden and st.button(f"Show {min(hidden, HISTORY_PAGE_SIZE)} earlier messages"):
+        st.session_state.history_visible += HISTORY_PAGE_SIZE
+        st.rerun()
+    if visible > len(messages) and st.session_state.history_total > len(messages):
+        # earlier pages are not kept in session state, so they are read and rendered on request
+        older = get_chat_log().tail(st.session_state.session_id, visible)
+        html = "".join(render_message(message, user_template, bot_template) for message in older)
+    else:
+        # only messages added since the last rerun are rendered from scratch
+        html = history_html(messages, st.session_state.rendered_history, user_template, bot_template, visible)
+    if html:
+        st.write(html, unsafe_allow_html=True)
+
+def select_memory_mode():
+    memory_mode = st.selectbox(
+    'Conversation memory',
+    (f'Last {MEMORY_TURNS} turns + summary', f'Last {MEMORY_TURNS} turns', 'Full history'))
+    return memory_mode
+
+def get_cached_answer(user_question):
+    # only first questions are shared; follow-ups depend on the conversation so far
+    if st.session_state.history_total or st.session_state.answer_namespace is None:
+        return None, None
+    embeddings = get_embeddings()
+    if embeddings is None:
+        return None, None
+    # the retriever reuses this embedding for the same question
+    question_embedding = get_retrieval_cache().embed_query(embeddings, user_question)
+    return get_answer_cache().lookup(st.session_state.answer_namespace, question_embedding, user_question), question_embedding
+
+@st.cache_resource
+def get_trace_store():
+    # per-question latency spans, summarised on the Metrics page
+    return TraceStore()
+
+@st.cache_resource
+def start_preload():
+    # once per process: import the chain stack while the first page renders
+    return preload()
+
+@st.cache_resource
+def get_request_queue():
+    # one background loop per process runs every session's questions
+    return RequestQueue()
+
+def get_session_conversation():
+    if get_session_objects().get('conversation') is None and st.session_state.chain_settings is not None:
+        # evicted while idle: rebuild with the last settings before the sidebar runs
+        sync_conversation(*st.session_state.chain_settings, st.session_state.memory_mode, load_shared_index())
+    return get_session_objects().get('conversation')
+
 def handle_userinput(user_question):
-    if not st.session_state.conversation:
+    conversation = get_session_conversation()
+    if not conversation:
         st.error("No conversation available. Please process documents first.")
         return
     
+    model, student_type = st.session_state.chain_settings
+    started_at = time.perf_counter()
     try:
-        response = st.session_state.conversation({'question': user_question})
-        st.session_state.chat_history = response['chat_history']
-        for i, message in enumerate(st.session_state.chat_history):
-            if i % 2 == 0:
-                st.write(user_template.replace(
-                    "{{MSG}}", message.content), unsafe_allow_html=True)
-            else:
-                st.write(bot_template.replace(
-                    "{{MSG}}", message.content), unsafe_allow_html=True)
+        # earlier turns first, then the new question and its answer as it streams in
+        render_chat_history()
+        st.write(user_template.replace("{{MSG}}", user_question), unsafe_allow_html=True)
+        cached_answer, question_embedding = get_cached_answer(user_question)
+        if cached_answer is not None:
+            st.write(bot_template.replace("{{MSG}}", cached_answer), unsafe_allow_html=True)
+            st.caption("Answered from cache")
+            # keep the chain's memory in step so follow-ups have context
+            conversation.memory.save_context({'question': user_question}, {'answer': cached_answer})
+            append_history({"role": "user", "content": user_question},
+                           {"role": "assistant", "content": cached_answer})
+            get_trace_store().record(model, student_type, cached=True,
+                                     total_seconds=time.perf_counter() - started_at)
+            return
+        from stream_handler import StreamHandler
+
+        handler = StreamHandler()
+        if COALESCE_ACROSS_SESSIONS and question_embedding is not None:
+            key = ('shared', st.session_state.answer_namespace, normalize_question(user_question))
+        else:
+            key = (st.session_state.session_id, user_question)
+        # the span is recorded by the request itself, even if this session goes away
+        answer = traced(get_trace_store(), handler,
+                        lambda: conversation({'question': user_question}, callbacks=[handler]), model, student_type)
+        future, stream_handler, is_new = get_request_queue().submit(key, answer, handler)
+        st.session_state.pending = {
+            'question': user_question,
+            'future': future,
+            'stream_handler': stream_handler,
+            # another session's chain answered, so this session's memory still needs the turn
+            'save_to_memory': not is_new and key[0] == 'shared',
+            'question_embedding': question_embedding,
+        }
+        wait_for_answer()
     except Exception as e:
+        get_trace_store().record(model, student_type, status='error', error=type(e).__name__,
+                                 total_seconds=time.perf_counter() - started_at)
         st.error(f"Error processing question: {e}")
 
+def run_batch(question_file):
+    conversation = get_session_conversation()
+    if conversation is None:
+        st.error("No conversation available. Please process documents first.")
+        return
+    from batch import answer_questions, read_questions, to_csv
+
+    questions = read_questions(question_file.getvalue(), question_file.name)
+    if not questions:
+        st.error("No questions found in the file")
+        return
+    model, student_type = st.session_state.chain_settings
+    progress = st.progress(0.0, text=f"Answering {len(questions)} questions")
+    # questions are retrieved together and answered in parallel, without chat memory
+    rows = answer_questions(questions, conversation.retriever, get_chain_skeleton(MODEL_NAMES[model], student_type),
+                            progress=lambda done, total: progress.progress(done / total, text=f"{done}/{total} answered"))
+    failed = sum(1 for row in rows if row['error'])
+    if failed:
+        st.warning(f"{failed} of {len(rows)} questions failed; see the error column")
+    st.session_state.batch_csv = to_csv(rows)
+
+def wait_for_answer():
+    # the request runs off the script thread; a rerun stops this loop but not the request,
+    # and the next run picks it up again from session state
+    pending = st.session_state.pending
+    stream_handler = pending['stream_handler']
+    placeholder = st.empty()
+    while not pending['future'].done():
+        placeholder.write(bot_template.replace("{{MSG}}", stream_handler.text or "..."), unsafe_allow_html=True)
+        time.sleep(POLL_INTERVAL)
+    st.session_state.pending = None
+    try:
+        response = pending['future'].result()
+    except Exception as e:
+        placeholder.empty()
+        st.error(f"Error processing question: {e}")
+        return
+    user_question = pending['question']
+    memory = get_session_objects().get('memory')
+    if pending['save_to_memory'] and memory is not None:
+        memory.save_context({'question': user_question}, {'answer': response['answer']})
+    placeholder.write(bot_template.replace("{{MSG}}", response['answer']), unsafe_allow_html=True)
+    append_history({"role": "user", "content": user_question},
+                   {"role": "assistant", "content": response['answer']})
+    if pending['question_embedding'] is not None:
+        get_answer_cache().store(st.session_state.answer_namespace, pending['question_embedding'], user_question,
+                                 response['answer'])
+    if stream_handler.time_to_first_token is not None:
+        saved = stream_handler.context_tokens_saved
+        st.caption(f"First token after {stream_handler.time_to_first_token:.1f}s, "
+                   f"prompt {stream_handler.prompt_tokens} tokens"
+                   + (f", {saved} retrieved tokens left out of the context" if saved else ""))
+
 def main():
     # Environment variables are already loaded at module level
     
@@ -199,25 +591,81 @@ def main():
     if LOCAL_MODULES_AVAILABLE:
         st.write(css, unsafe_allow_html=True)
     
-    if "conversation" not in st.session_state:
-        st.session_state.conversation = None
-    if "chat_history" not in st.session_state:
-        st.session_state.chat_history = None
-    
     st.header("Chat with TX School Psych Chatbot")
     
     # Check if all dependencies are available
     if not all([PDF_AVAILABLE, LANGCHAIN_AVAILABLE, LOCAL_MODULES_AVAILABLE]):
         st.error("Some dependencies are missing. Please check the installation.")
         st.stop()
+    start_preload()
+    
+    # session state holds only small handles: the chain, memory and uploaded
+    # index live in the session store and index cache, the full chat in the chat log
+    if "chat_history" not in st.session_state:
+        st.session_state.chat_history = []
+    if "history_total" not in st.session_state:
+        st.session_state.history_total = 0
+    if "rendered_history" not in st.session_state:
+        st.session_state.rendered_history = []
+    if "history_visible" not in st.session_state:
+        st.session_state.history_visible = HISTORY_PAGE_SIZE
+    if "last_question" not in st.session_state:
+        st.session_state.last_question = None
+    if "answer_namespace" not in st.session_state:
+        st.session_state.answer_namespace = None
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    if "pending" not in st.session_state:
+        st.session_state.pending = None
+    if "chain_settings" not in st.session_state:
+        st.session_state.chain_settings = None
+    # the session's indexes and memory outlive any one chain, so changing the
+    # model or student type only swaps the cached chain skeleton around them
+    if "overlay_key" not in st.session_state:
+        st.session_state.overlay_key = None
+    # name -> content hash and chunk count of each file in the overlay index
+    if "uploaded_files" not in st.session_state:
+        st.session_state.uploaded_files = {}
+    if "index_version" not in st.session_state:
+        st.session_state.index_version = None
+    if "memory_mode" not in st.session_state:
+        st.session_state.memory_mode = None
+    if "batch_csv" not in st.session_state:
+        st.session_state.batch_csv = None
+    get_session_store().evict_idle()
     
     user_question = st.text_input("Ask a question as if you were talking to your supervisor:")
-    if user_question:
+    if st.session_state.pending is not None:
+        # a question from an earlier run is still being answered
+        render_chat_history()
+        st.write(user_template.replace("{{MSG}}", st.session_state.pending['question']), unsafe_allow_html=True)
+        wait_for_answer()
+    # text_input keeps its value across reruns, so only a new question is sent
+    elif user_question and user_question != st.session_state.last_question:
+        st.session_state.last_question = user_question
         handle_userinput(user_question)
+    else:
+        render_chat_history()
     
     if st.button("Clear memory"):
-        if st.session_state.chat_history:
-            st.session_state.chat_history.clear()
+        st.session_state.chat_history = []
+        st.session_state.history_total = 0
+        st.session_state.rendered_history = []
+        st.session_state.history_visible = HISTORY_PAGE_SIZE
+        get_chat_log().clear(st.session_state.session_id)
+        memory = get_session_objects().get('memory')
+        if memory is not None:
+            memory.clear()
+        st.rerun()
+    
+    with st.expander("Batch questions"):
+        question_file = st.file_uploader("Upload a CSV or text file of questions, one per row",
+                                         type=['csv', 'txt'])
+        if question_file is not None and st.button("Answer all"):
+            run_batch(question_file)
+        if st.session_state.batch_csv:
+            st.download_button("Download answers", st.session_state.batch_csv, file_name="answers.csv",
+                               mime="text/csv")
     
     with st.sidebar:
         #select model
@@ -226,34 +674,73 @@ def main():
             st.stop()
         #select student type
         student_type = select_student_type()
+        memory_mode = select_memory_mode()
+        shared_index = load_shared_index()
+        if shared_index is not None:
+            st.caption(f"Shared corpus: {shared_index.index.ntotal} chunks")
+            if st.session_state.index_version is None:
+                st.session_state.index_version = get_shared_index_version()
+        sync_conversation(model, student_type, memory_mode, shared_index)
+        cache_stats = get_answer_cache().stats()
+        st.caption(f"Answer cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+                   f"({cache_stats['entries']} stored)")
+        queue_stats = get_request_queue().stats()
+        st.caption(f"Requests: {queue_stats['in_flight']} in flight, {queue_stats['coalesced']} coalesced")
+        retrieval_stats = get_retrieval_cache().stats()
+        st.caption(f"Retrieval cache: {retrieval_stats['result_hits']} result and "
+                   f"{retrieval_stats['embedding_hits']} embedding hits, "
+                   f"~{retrieval_stats['embed_seconds_saved']:.1f}s of embedding calls saved "
+                   f"({retrieval_stats['mean_embed_seconds'] * 1000:.0f} ms each)")
+        with st.expander("Import times"):
+            for name, seconds in import_report():
+                st.write(f"{name}: {seconds:.2f}s")
+        with st.expander("Session memory"):
+            # shared indexes and models are left out; the Sessions page lists every session
+            st.write(f"session state: {approx_size(dict(st.session_state)) / 1024:.0f} KB")
+            for name, size in get_session_store().sizes(st.session_state.session_id).items():
+                st.write(f"{name}: {size / 1024:.0f} KB")
         st.subheader("Your documents")
         pdf_docs = st.file_uploader(
             "Upload your PDFs here and click on 'Process'", accept_multiple_files=True)
         if st.button("Process"):
             with st.spinner("Processing"):
-                # get pdf text
-                raw_text = get_pdf_text(pdf_docs)  
-                if raw_text == "":
+                if not pdf_docs and not st.session_state.uploaded_files:
                     st.error("Please upload at least one PDF")
                     st.stop()
-                else:
-                    # get the text chunks
-                    text_chunks = get_text_chunks(raw_text)
-                    if not text_chunks:
-                        st.error("Failed to process text chunks")
+                index_key = get_index_key(pdf_docs) if pdf_docs else None
+                # reuse the saved index if these exact files were processed before
+                vectorstore = get_overlay_index(index_key) if index_key else None
+                if vectorstore is not None:
+                    counts = file_chunk_counts(vectorstore)
+                    st.session_state.uploaded_files = {
+                        pdf.name: {'sha256': index_cache.file_hash(pdf), 'chunks': counts[pdf.name]} for pdf in pdf_docs}
+                elif index_key is not None:
+                    get_overlay_index.clear(index_key)
+                    # only the files added, changed or removed since the last Process are handled
+                    files = update_vectorstore(pdf_docs, index_key)
+                    if files is None:
+                        st.error("Failed to update vector store. Please check your OpenAI API key.")
                         st.stop()
-                    # create vector store
-                    vectorstore = get_vectorstore(text_chunks)
-                    if vectorstore is None:
-                        st.error("Failed to create vector store. Please check your OpenAI API key.")
+                    # the session keeps only the key, so the index is served from the index cache
+                    if get_overlay_index(index_key) is None:
+                        get_overlay_index.clear(index_key)
+                        st.error("Could not store the uploaded documents' index. Please try again.")
                         st.stop()
-                    # create conversation chain
-                    conversation = get_conversation_chain(vectorstore, model, student_type)
-                    if conversation:
-                        st.session_state.conversation = conversation
-                        st.success("Documents processed successfully!")
-                    else:
-                        st.error("Failed to create conversation chain. Please check your API keys and try again.")
+                    st.session_state.uploaded_files = files
+                else:
+                    # every upload was removed; the shared corpus remains
+                    st.session_state.uploaded_files = {}
+                # create conversation chain
+                st.session_state.overlay_key = index_key
+                st.session_state.index_version = "+".join(filter(None, [get_shared_index_version() if shared_index else None, index_key])) or None
+                get_session_objects().pop('conversation', None)
+                sync_conversation(model, student_type, memory_mode, shared_index)
+                if index_key is None and shared_index is None:
+                    st.info("All uploaded documents were removed.")
+                elif get_session_objects().get('conversation') is not None:
+                    st.success("Documents processed successfully! The conversation continues with them.")
+                else:
+                    st.error("Failed to create conversation chain. Please check your API keys and try again.")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
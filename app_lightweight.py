@@ -31,20 +31,40 @@ if not OPENAI_API_KEY:
 
 # Try to import dependencies
 try:
-    from PyPDF2 import PdfReader
+    from pdf_extract import iter_pdf_pages
+    from chunking import CHUNK_SIZE, CHUNK_OVERLAP, CHUNKER_VERSION, iter_chunks
+    from bm25 import BM25Index
+    from index_cache import index_key
     PDF_AVAILABLE = True
 except ImportError:
     PDF_AVAILABLE = False
     st.error("PyPDF2 not available")
 
 try:
-    import openai
-    openai.api_key = OPENAI_API_KEY
+    from llm_client import get_openai_client
     OPENAI_AVAILABLE = True
 except ImportError:
     OPENAI_AVAILABLE = False
     st.error("OpenAI not available")
 
+from chat_render import HISTORY_PAGE_SIZE, history_html, hidden_count
+from session_store import SESSION_IDLE_SECONDS
+
+# passages sent with each question instead of the whole document set
+TOP_K_PASSAGES = 6
+
+USER_TEMPLATE = """
+<div class="chat-message user">
+    <div class="message"><strong>You:</strong> {{MSG}}</div>
+</div>
+"""
+
+BOT_TEMPLATE = """
+<div class="chat-message bot">
+    <div class="message"><strong>Assistant:</strong> {{MSG}}</div>
+</div>
+"""
+
 if not all([PDF_AVAILABLE, OPENAI_AVAILABLE]):
     st.error("Some dependencies are missing. Consider deploying to Hugging Face Spaces instead.")
     st.info("""
@@ -59,24 +79,41 @@ if not all([PDF_AVAILABLE, OPENAI_AVAILABLE]):
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
 
-if "processed_text" not in st.session_state:
-    st.session_state.processed_text = ""
+if "documents_key" not in st.session_state:
+    st.session_state.documents_key = None
+
+if "rendered_history" not in st.session_state:
+    st.session_state.rendered_history = []
 
-def extract_pdf_text(pdf_files):
-    """Extract text from PDF files"""
-    text = ""
-    for pdf_file in pdf_files:
-        pdf_reader = PdfReader(pdf_file)
-        for page in pdf_reader.pages:
-            text += page.extract_text()
-    return text
+if "history_visible" not in st.session_state:
+    st.session_state.history_visible = HISTORY_PAGE_SIZE
+
+def get_documents_key(pdf_files):
+    return index_key(pdf_files, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, chunker=CHUNKER_VERSION)
+
+# sessions keep only the documents key; indexes nobody has asked for in a while are dropped
+@st.cache_resource(max_entries=16, ttl=SESSION_IDLE_SECONDS)
+def build_passage_index(documents_key, _pdf_files):
+    """Chunk the PDFs and index the passages for keyword search, once per document set"""
+    passages = list(iter_chunks(iter_pdf_pages(_pdf_files)))
+    return passages, BM25Index([text for text, _ in passages])
+
+def retrieve_context(question, passages, index, k=TOP_K_PASSAGES):
+    """The top k passages for the question, each headed by its citation"""
+    hits = index.search(question, k)
+    if not hits:
+        # nothing matched any keyword; fall back to the opening passages
+        hits = [(doc_id, 0.0) for doc_id in range(min(k, len(passages)))]
+    return "\n\n".join(f"[{passages[doc_id][1]['citation']}]\n{passages[doc_id][0]}" for doc_id, _ in hits)
 
 def get_ai_response(question, context=""):
     """Get AI response using OpenAI"""
     try:
         prompt = f"""
         You are a licensed school psychologist supervisor in Texas. 
-        Answer the following question based on the context provided.
+        Answer the following question based on the context provided, which
+        holds the most relevant passages from the uploaded documents, each
+        headed by its source in brackets.
         
         Context: {context}
         
@@ -85,7 +122,8 @@ def get_ai_response(question, context=""):
         Provide a professional, accurate response with citations if applicable.
         """
         
-        response = openai.ChatCompletion.create(
+        # shared, pooled and rate-limited client (reads OPENAI_API_KEY itself)
+        response = get_openai_client().chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": "You are a licensed school psychologist supervisor in Texas."},
@@ -110,7 +148,9 @@ with st.sidebar:
     if st.button("Process Documents"):
         if pdf_files:
             with st.spinner("Processing PDFs..."):
-                st.session_state.processed_text = extract_pdf_text(pdf_files)
+                documents_key = get_documents_key(pdf_files)
+                build_passage_index(documents_key, pdf_files)
+                st.session_state.documents_key = documents_key
                 st.success(f"Processed {len(pdf_files)} PDF(s)")
         else:
             st.error("Please upload at least one PDF file")
@@ -119,33 +159,35 @@ with st.sidebar:
 st.subheader("Ask Questions")
 
 # Display chat history
-for message in st.session_state.chat_history:
-    if message["role"] == "user":
-        st.markdown(f"""
-        <div class="chat-message user">
-            <div class="message"><strong>You:</strong> {message["content"]}</div>
-        </div>
-        """, unsafe_allow_html=True)
-    else:
-        st.markdown(f"""
-        <div class="chat-message bot">
-            <div class="message"><strong>Assistant:</strong> {message["content"]}</div>
-        </div>
-        """, unsafe_allow_html=True)
+hidden = hidden_count(st.session_state.chat_history, st.session_state.history_visible)
+if hidden and st.button(f"Show {min(hidden, HISTORY_PAGE_SIZE)} earlier messages"):
+    st.session_state.history_visible += HISTORY_PAGE_SIZE
+    st.rerun()
+history = history_html(st.session_state.chat_history, st.session_state.rendered_history,
+                       USER_TEMPLATE, BOT_TEMPLATE, st.session_state.history_visible)
+if history:
+    st.markdown(history, unsafe_allow_html=True)
 
 # User input
 user_question = st.text_input("Ask a question:")
 if st.button("Send"):
     if user_question:
-        if not st.session_state.processed_text:
+        if not st.session_state.documents_key:
             st.error("Please process documents first")
+        elif not pdf_files:
+            st.error("Please upload the processed PDFs again")
+        elif get_documents_key(pdf_files) != st.session_state.documents_key:
+            # the cached index belongs to the processed files, never to these
+            st.error("The uploaded PDFs changed since they were processed. Please click Process again")
         else:
             # Add user message to history
             st.session_state.chat_history.append({"role": "user", "content": user_question})
             
             # Get AI response
             with st.spinner("Getting response..."):
-                ai_response = get_ai_response(user_question, st.session_state.processed_text)
+                # cached per document set; the files are only re-read if it was evicted
+                passages, index = build_passage_index(st.session_state.documents_key, pdf_files)
+                ai_response = get_ai_response(user_question, retrieve_context(user_question, passages, index))
                 st.session_state.chat_history.append({"role": "assistant", "content": ai_response})
             
             st.rerun()
@@ -153,8 +195,11 @@ if st.button("Send"):
 # Clear chat button
 if st.button("Clear Chat"):
     st.session_state.chat_history = []
+    st.session_state.rendered_history = []
+    st.session_state.history_visible = HISTORY_PAGE_SIZE
     st.rerun()
 
-# Show processed text length
-if st.session_state.processed_text:
-    st.info(f"📄 Processed text length: {len(st.session_state.processed_text)} characters") 
\ No newline at end of file
+# Show how much was indexed
+if st.session_state.documents_key and pdf_files and get_documents_key(pdf_files) == st.session_state.documents_key:
+    passages, _ = build_passage_index(st.session_state.documents_key, pdf_files)
+    st.info(f"📄 Indexed {len(passages)} passages; the {TOP_K_PASSAGES} most relevant are sent with each question") 
\ No newline at end of file
@@ -0,0 +1,128 @@
+"""Answer a file of questions against an index in one go
+
+    python -m batch questions.csv [--output answers.csv] [--index shared_index] [--concurrency 8]
+
+Questions come from a CSV (a "question" column, or else the first column) or
+a text file with one question per line. All questions are embedded in one
+call and each index is searched once for the whole set; the answers are then
+requested concurrently, at most BATCH_CONCURRENCY at a time, through the
+shared OpenAI client and its rate limiter. Each question is answered on its
+own, without chat history. The output CSV has the question, answer, the
+citations of the chunks used, and the error if a question failed.
+
+The app offers the same from the "Batch questions" expander.
+"""
+import argparse
+import csv
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '8'))
+OUTPUT_COLUMNS = ['question', 'answer', 'sources', 'error']
+
+
+def read_questions(data, filename=''):
+    """Questions from CSV or plain-text bytes, in order, skipping blanks"""
+    text = data.decode('utf-8-sig') if isinstance(data, bytes) else data
+    if not filename.lower().endswith('.csv'):
+        return [line.strip() for line in text.splitlines() if line.strip()]
+    rows = [row for row in csv.reader(io.StringIO(text)) if row and any(cell.strip() for cell in row)]
+    if not rows:
+        return []
+    header = [cell.strip().lower() for cell in rows[0]]
+    column = header.index('question') if 'question' in header else 0
+    if 'question' in header:
+        rows = rows[1:]
+    return [row[column].strip() for row in rows if len(row) > column and row[column].strip()]
+
+
+def answer_questions(questions, retriever, skeleton, concurrency=BATCH_CONCURRENCY, progress=None):
+    """One output row per question, in order
+
+    skeleton is a chain skeleton from chains.build_answer_chain. progress, if
+    given, is called as progress(done, total) from the calling thread.
+    """
+    combine_docs_chain, _ = skeleton
+    documents = retriever.retrieve_many(questions)
+
+    def answer(question, docs):
+        return combine_docs_chain.run(input_documents=docs, question=question, chat_history='')
+
+    rows = [{'question': question,
+             'sources': "; ".join(dict.fromkeys(filter(None, (doc.metadata.get('citation') for doc in docs)))),
+             'answer': '', 'error': ''}
+            for question, docs in zip(questions, documents)]
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='batch') as pool:
+        futures = {pool.submit(answer, question, docs): i
+                   for i, (question, docs) in enumerate(zip(questions, documents))}
+        for done, future in enumerate(as_completed(futures), 1):
+            row = rows[futures[future]]
+            try:
+                row['answer'] = future.result()
+            except Exception as e:
+                # one failed question does not lose the rest of the batch
+                row['error'] = f"{type(e).__name__}: {e}"
+            if progress is not None:
+                progress(done, len(rows))
+    return rows
+
+
+def to_csv(rows):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=OUTPUT_COLUMNS)
+    writer.writeheader()
+    writer.writerows(rows)
+    return out.getvalue()
+
+
+def main(argv=None):
+    from langchain_community.chat_models import ChatOpenAI
+
+    from chains import STUDENT_PROMPTS, build_answer_chain
+    from embedding_backends import check_index_metadata, get_embeddings
+    from faiss_index import load_vectorstore
+    from ingest import DEFAULT_INDEX_DIR
+    from llm_client import get_openai_client
+    from retrieval import MergedRetriever, score_threshold_for
+
+    parser = argparse.ArgumentParser(description="Answer a CSV or text file of questions against an index")
+    parser.add_argument('questions', help="CSV with a 'question' column, or a text file with one per line")
+    parser.add_argument('--output', help="answers CSV (default: stdout)")
+    parser.add_argument('--index', action='append',
+                        help="index directory, repeat to search several (default: %s)" % DEFAULT_INDEX_DIR)
+    parser.add_argument('--backend', choices=['openai', 'local'],
+                        help="embedding backend (default: EMBEDDING_BACKEND or openai)")
+    parser.add_argument('--model', default='gpt-4o-mini')
+    parser.add_argument('--student-type', choices=list(STUDENT_PROMPTS), default='General')
+    parser.add_argument('--k', type=int, default=15, help="chunks retrieved per question")
+    parser.add_argument('--token-budget', type=int, default=6000, help="context tokens per question")
+    parser.add_argument('--concurrency', type=int, default=BATCH_CONCURRENCY, help="answers requested at once")
+    args = parser.parse_args(argv)
+
+    with open(args.questions, 'rb') as f:
+        questions = read_questions(f.read(), args.questions)
+    if not questions:
+        parser.error(f"no questions found in {args.questions}")
+    embeddings = get_embeddings(args.backend) if args.backend else get_embeddings()
+    vectorstores = []
+    for index_dir in args.index or [DEFAULT_INDEX_DIR]:
+        check_index_metadata(index_dir, embeddings)
+        vectorstores.append(load_vectorstore(index_dir, embeddings))
+    retriever = MergedRetriever(vectorstores=vectorstores, embeddings=embeddings, k=args.k,
+                                score_threshold=score_threshold_for(embeddings.model_name),
+                                token_budget=args.token_budget, model_name=args.model)
+    llm = ChatOpenAI(model=args.model, temperature=0, client=get_openai_client().chat.completions)
+    rows = answer_questions(questions, retriever, build_answer_chain(llm, args.student_type), args.concurrency,
+                            progress=lambda done, total: print(f"{done}/{total}", file=sys.stderr))
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            f.write(to_csv(rows))
+    else:
+        sys.stdout.write(to_csv(rows))
+    return 1 if any(row['error'] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
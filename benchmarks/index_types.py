@@ -0,0 +1,123 @@
+"""Recall and latency of each FAISS index type against exact search
+
+    python -m benchmarks.index_types [--index shared_index] [--questions questions.txt]
+    python -m benchmarks.index_types --synthetic 100000 --dim 1536
+
+Builds every index type from faiss_index over the same vectors, runs the same
+queries one at a time (as the app does) and prints JSON rows with build time,
+serialized size, mean and p95 query latency and recall@k against the flat
+index. IVF types are measured at several nprobe values to show the curve.
+Vectors come from a saved index (expanded to exact vectors via the embedding
+cache) or from a synthetic clustered set; queries are embedded questions or,
+by default, perturbed copies of stored vectors.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from faiss_index import INDEX_TYPES, build_index, index_type_of, to_flat, tune
+
+
+def synthetic_vectors(n, dim, clusters=100, seed=0):
+    """Unit vectors drawn around random cluster centres, roughly like text embeddings"""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim))
+    vectors = centres[rng.integers(clusters, size=n)] + 0.5 * rng.normal(size=(n, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def index_vectors(index_dir):
+    from embedding_backends import get_embeddings
+    from faiss_index import load_vectorstore
+
+    embeddings = get_embeddings()
+    vectorstore = load_vectorstore(index_dir, embeddings, mmap=False)
+    if index_type_of(vectorstore.index) != 'flat':
+        vectorstore = to_flat(vectorstore, embeddings)
+    return vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal), embeddings
+
+
+def sample_queries(vectors, n, seed=1):
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), size=min(n, len(vectors)), replace=False)]
+    queries = queries + 0.1 * rng.normal(size=queries.shape) * np.abs(queries).mean()
+    return queries.astype(np.float32)
+
+
+def time_queries(index, queries, k):
+    ids = np.empty((len(queries), k), dtype=np.int64)
+    seconds = []
+    for i, query in enumerate(queries):
+        t0 = time.perf_counter()
+        _, ids[i] = index.search(query[None, :], k)
+        seconds.append(time.perf_counter() - t0)
+    seconds.sort()
+    return ids, {
+        'mean_query_ms': round(1000 * sum(seconds) / len(seconds), 4),
+        'p95_query_ms': round(1000 * seconds[int(0.95 * (len(seconds) - 1))], 4),
+    }
+
+
+def recall(ids, truth):
+    k = truth.shape[1]
+    return round(float(np.mean([len(set(row) & set(expected)) / k for row, expected in zip(ids, truth)])), 4)
+
+
+def run(vectors, queries, k, types, nprobes):
+    import faiss
+
+    rows = []
+    truth = None
+    for index_type in ['flat'] + [t for t in types if t != 'flat']:
+        t0 = time.perf_counter()
+        index = build_index(vectors, index_type)
+        build_seconds = time.perf_counter() - t0
+        size_mb = round(len(faiss.serialize_index(index)) / 1024 / 1024, 2)
+        for nprobe in (nprobes if index_type.startswith('ivf') else [None]):
+            if nprobe is not None:
+                tune(index, nprobe=nprobe)
+            ids, latency = time_queries(index, queries, k)
+            if truth is None:
+                truth = ids
+            row = {'index_type': index_type, 'vectors': len(vectors), 'dim': vectors.shape[1],
+                   'build_seconds': round(build_seconds, 3), 'size_mb': size_mb}
+            if nprobe is not None:
+                row['nprobe'] = min(nprobe, faiss.extract_index_ivf(index).nlist)
+            row.update(latency)
+            row[f'recall_at_{k}'] = recall(ids, truth)
+            rows.append(row)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--index', help="saved index directory (default: synthetic vectors)")
+    parser.add_argument('--synthetic', type=int, default=50000, help="synthetic vector count")
+    parser.add_argument('--dim', type=int, default=384, help="synthetic vector dimension")
+    parser.add_argument('--questions', help="file of questions, one per line, embedded as queries")
+    parser.add_argument('--queries', type=int, default=200, help="sampled queries when no questions are given")
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--types', nargs='+', choices=INDEX_TYPES, default=INDEX_TYPES)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[4, 16, 64])
+    args = parser.parse_args(argv)
+
+    embeddings = None
+    if args.index:
+        vectors, embeddings = index_vectors(args.index)
+    else:
+        vectors = synthetic_vectors(args.synthetic, args.dim)
+    if args.questions:
+        if embeddings is None:
+            parser.error("--questions needs --index, so they are embedded like its chunks")
+        with open(args.questions) as f:
+            questions = [line.strip() for line in f if line.strip()]
+        queries = np.array([embeddings.embed_query(q) for q in questions], dtype=np.float32)
+    else:
+        queries = sample_queries(vectors, args.queries)
+    print(json.dumps(run(vectors, queries, args.k, args.types, args.nprobe), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""Local mock of the OpenAI chat API, and a check of llm_client against it
+
+    python -m benchmarks.mock_openai check [--retry-after 0.5] [--rpm 60]
+    python -m benchmarks.mock_openai serve [--port 8000] [--rate-limit-every 3] [--delay 0.2]
+
+check starts the mock on a free port and runs llm_client's transport against
+it: a streamed answer that first gets a 429 with Retry-After must arrive
+after one retry no sooner than Retry-After, and requests beyond a full
+requests-per-minute bucket must be paced at its refill rate. It prints JSON
+and exits non-zero if either fails. serve runs the mock until interrupted;
+point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8000/v1 (and any
+OPENAI_API_KEY) to exercise retries and rate limiting by hand.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = "Summary: parents may attend ARD committee meetings remotely (34 CFR, §300.322)."
+
+
+class MockOpenAI(ThreadingHTTPServer):
+    """Answers every chat completion with ANSWER, streamed or not
+
+    The first fail_first requests, and every rate_limit_every-th one, are
+    refused with a 429 and a Retry-After of retry_after seconds. Arrival
+    times of all requests are kept in `arrivals`.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port=0, rate_limit_every=0, retry_after=1.0, delay=0.0, fail_first=0):
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.rate_limit_every = rate_limit_every
+        self.fail_first = fail_first
+        self.retry_after = retry_after
+        self.delay = delay
+        self.arrivals = []
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['content-length'])) or b'{}')
+        server = self.server
+        with server.lock:
+            server.arrivals.append(time.monotonic())
+            count = len(server.arrivals)
+        if count <= server.fail_first or (server.rate_limit_every and count % server.rate_limit_every == 0):
+            self._send_json(429, {'error': {'message': "Rate limit reached", 'type': 'rate_limit_error'}},
+                            {'retry-after': f"{server.retry_after:g}"})
+            return
+        time.sleep(server.delay)
+        if body.get('stream'):
+            self._stream(body.get('model', 'mock'))
+        else:
+            self._send_json(200, {
+                'id': 'mock', 'object': 'chat.completion', 'created': 0, 'model': body.get('model', 'mock'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ANSWER},
+                             'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+            })
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, model):
+        self.send_response(200)
+        self.send_header('content-type', 'text/event-stream')
+        self.send_header('transfer-encoding', 'chunked')
+        self.end_headers()
+
+        def write(event):
+            data = f"data: {event}\n\n".encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        for word in ANSWER.split(' '):
+            write(json.dumps({'id': 'mock', 'object': 'chat.completion.chunk', 'created': 0, 'model': model,
+                              'choices': [{'index': 0, 'delta': {'content': word + ' '}, 'finish_reason': None}]}))
+        write('[DONE]')
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+def _client(base_url, **transport_args):
+    import httpx
+    from openai import OpenAI
+
+    from llm_client import RateLimitedTransport
+
+    return OpenAI(base_url=base_url, api_key='mock', max_retries=0,
+                  http_client=httpx.Client(transport=RateLimitedTransport(**transport_args)))
+
+
+def check_retry(retry_after):
+    """A streamed answer refused once with a 429 arrives after one retry, no sooner than Retry-After"""
+    server = MockOpenAI(retry_after=retry_after, fail_first=1).start()
+    try:
+        client = _client(server.base_url, max_retries=2)
+        stream = client.chat.completions.create(model='mock', stream=True,
+                                                messages=[{'role': 'user', 'content': "Can parents attend remotely?"}])
+        text = "".join(chunk.choices[0].delta.content or "" for chunk in stream).strip()
+    finally:
+        server.shutdown()
+    waited = server.arrivals[1] - server.arrivals[0] if len(server.arrivals) == 2 else None
+    return {
+        'check': 'retry',
+        'requests': len(server.arrivals),
+        'retry_after': retry_after,
+        'waited_seconds': round(waited, 3) if waited is not None else None,
+        'ok': text == ANSWER and waited is not None and waited >= retry_after,
+    }
+
+
+def check_pacing(rpm, extra=3, concurrency=16):
+    """A full bucket of rpm requests goes out at once, the extra ones 60 / rpm seconds apart"""
+    server = MockOpenAI().start()
+    try:
+        client = _client(server.base_url, requests_per_minute=rpm, tokens_per_minute=10 ** 9)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(lambda _: client.chat.completions.create(
+                model='mock', messages=[{'role': 'user', 'content': "ping"}]), range(rpm + extra)))
+    finally:
+        server.shutdown()
+    seconds = server.arrivals[-1] - server.arrivals[0]
+    expected = extra * 60.0 / rpm
+    return {
+        'check': 'pacing',
+        'requests': len(server.arrivals),
+        'rpm': rpm,
+        'seconds': round(seconds, 3),
+        'expected_seconds': round(expected, 3),
+        # the burst itself takes a moment, during which the bucket refills a little
+        'ok': expected * 0.9 <= seconds <= expected + 1.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    check = commands.add_parser('check', help="run llm_client's retry and rate limiting against the mock")
+    check.add_argument('--retry-after', type=float, default=0.5)
+    check.add_argument('--rpm', type=int, default=60)
+    serve = commands.add_parser('serve', help="run the mock until interrupted")
+    serve.add_argument('--port', type=int, default=8000)
+    serve.add_argument('--rate-limit-every', type=int, default=0, help="refuse every Nth request with a 429")
+    serve.add_argument('--retry-after', type=float, default=1.0)
+    serve.add_argument('--delay', type=float, default=0.0, help="seconds before each answer starts")
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        server = MockOpenAI(args.port, args.rate_limit_every, args.retry_after, args.delay)
+        print(f"OPENAI_BASE_URL={server.base_url}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+    results = [check_retry(args.retry_after), check_pacing(args.rpm)]
+    print(json.dumps(results, indent=2))
+    return 0 if all(result['ok'] for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""Time each stage of ingest -> retrieve -> answer as the corpus grows
+
+    python -m benchmarks.pipeline [--pages 10 100 500] [--files 2] [--questions 5]
+
+Generates synthetic statute-like PDFs, then runs the app's own extraction,
+chunking, FAISS indexing, hybrid retrieval and conversation chain on them.
+Embeddings come from a deterministic fake and answers from a stub chat model,
+so no API key or network is needed and runs are repeatable. Prints JSON, one
+row per corpus size. peak_rss_mb is the process high-water mark after each
+stage, so run one size per process when comparing memory.
+"""
+import argparse
+import hashlib
+import io
+import json
+import random
+import re
+import resource
+import sys
+import time
+from functools import lru_cache
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from chains import build_answer_chain, build_conversation_chain
+from chunking import CHUNK_SIZE, CHUNK_OVERLAP, iter_chunks, to_documents
+from pdf_extract import iter_pdf_pages
+
+LINES_PER_PAGE = 45
+EMBEDDING_DIM = 1536
+# same retrieval settings as app.py for 'General' on GPT 3.5
+RETRIEVER_K = 15
+SCORE_THRESHOLD = 0.42
+TOKEN_BUDGET = 2500
+# ada-002 puts unrelated texts at a cosine of about 0.75, and SCORE_THRESHOLD
+# is tuned to that; random unit vectors sit near 0 and would all be dropped
+BASELINE_COSINE = 0.75
+ANSWER = "Summary: parents may attend ARD committee meetings remotely (34 CFR, §300.322)."
+QUESTIONS = [
+    "Can parents attend ARD meetings remotely?",
+    "How often must a reevaluation happen under 300.303?",
+    "What notice does the district give before an ARD meeting?",
+    "Who must attend the ARD committee meeting?",
+    "When is parental consent required for an evaluation?",
+]
+WORDS = ("the district shall provide parent notice evaluation committee meeting student services "
+         "consent records school days eligibility disability special education reevaluation").split()
+
+
+def _pdf_string(text):
+    return text.replace('\\', '').replace('(', '').replace(')', '')
+
+
+def make_pdf(pages):
+    """Minimal PDF with one Helvetica text line per entry of each page"""
+    objects = [b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    pages_id = 2 + 2 * len(pages)
+    kids = []
+    for lines in pages:
+        stream = ("BT /F1 10 Tf 50 750 Td 12 TL "
+                  + " ".join(f"({_pdf_string(line)}) '" for line in lines) + " ET").encode('latin-1')
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+                       b"/Resources << /Font << /F1 1 0 R >> >> >>" % (pages_id, len(objects)))
+        kids.append(len(objects))
+    objects.append(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % k for k in kids), len(kids)))
+    objects.append(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, len(objects), xref)
+    return out
+
+
+def synthetic_pdfs(total_pages, files, seed=0):
+    """files in-memory PDFs with total_pages pages of section-headed filler text between them"""
+    rng = random.Random(seed)
+    pdfs = []
+    for file_no in range(files):
+        pages = []
+        for page_no in range(total_pages // files + (file_no < total_pages % files)):
+            lines = [f"§{300 + file_no}.{page_no + 1} Section {page_no + 1}"]
+            lines += [" ".join(rng.choice(WORDS) for _ in range(12)) for _ in range(LINES_PER_PAGE - 1)]
+            pages.append(lines)
+        pdf = io.BytesIO(make_pdf(pages))
+        pdf.name = f"synthetic-{file_no}.pdf"
+        pdfs.append(pdf)
+    return pdfs
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic unit vectors scored like a real model's
+
+    Each text is a bag of per-word random vectors, so texts sharing words are
+    closer, mixed with one direction shared by every text so unrelated texts
+    still sit at BASELINE_COSINE.
+    """
+
+    def __init__(self, size=EMBEDDING_DIM):
+        self.size = size
+        self._shared = self._word_vector('')
+
+    @lru_cache(maxsize=None)
+    def _word_vector(self, word):
+        seed = int.from_bytes(hashlib.sha256(word.encode()).digest()[:8], 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.size)
+        return vector / np.linalg.norm(vector)
+
+    def _embed(self, text):
+        words = re.findall(r'\w+', text.lower())
+        bag = np.sum([self._word_vector(word) for word in words], axis=0) if words else np.zeros(self.size)
+        norm = np.linalg.norm(bag)
+        vector = np.sqrt(BASELINE_COSINE) * self._shared
+        if norm:
+            vector = vector + np.sqrt(1 - BASELINE_COSINE) * bag / norm
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class Stages:
+    def __init__(self):
+        self.rows = {}
+
+    def run(self, name, fn):
+        t0 = time.perf_counter()
+        result = fn()
+        self.rows[name] = {'seconds': round(time.perf_counter() - t0, 4), 'peak_rss_mb': peak_rss_mb()}
+        return result
+
+
+def run(total_pages, files, questions):
+    from langchain.memory import ConversationBufferMemory
+    from langchain_community.chat_models.fake import FakeListChatModel
+    from langchain_community.vectorstores import FAISS
+    from retrieval import MergedRetriever
+    from stream_handler import StreamHandler
+
+    stages = Stages()
+    pdfs = stages.run('generate', lambda: synthetic_pdfs(total_pages, files))
+    pages = stages.run('extract', lambda: list(iter_pdf_pages(pdfs)))
+    docs = stages.run('chunk', lambda: to_documents(iter_chunks(pages, CHUNK_SIZE, CHUNK_OVERLAP)))
+    embeddings = FakeEmbeddings()
+    vectorstore = stages.run('index', lambda: FAISS.from_documents(docs, embeddings))
+    retriever = MergedRetriever(vectorstores=[vectorstore], embeddings=embeddings, k=RETRIEVER_K,
+                                score_threshold=SCORE_THRESHOLD, token_budget=TOKEN_BUDGET)
+    questions = [QUESTIONS[i % len(QUESTIONS)] for i in range(questions)]
+    retrieved = stages.run('retrieve', lambda: [retriever.get_relevant_documents(q) for q in questions])
+    llm = FakeListChatModel(responses=[ANSWER])
+    memory = ConversationBufferMemory(memory_key='chat_history', output_key='answer', return_messages=True)
+    skeleton = stages.run('build_chain', lambda: build_answer_chain(llm, 'General'))
+    chain = build_conversation_chain(skeleton, retriever, memory)
+
+    prompt_tokens = []
+
+    def answer():
+        for question in questions:
+            handler = StreamHandler()
+            chain({'question': question}, callbacks=[handler])
+            prompt_tokens.append(handler.prompt_tokens)
+
+    stages.run('answer', answer)
+    return {
+        'pages': len(pages),
+        'files': files,
+        'chunks': len(docs),
+        'questions': len(questions),
+        'context_chunks_per_question': round(sum(map(len, retrieved)) / len(retrieved), 1),
+        'prompt_tokens_per_question': round(sum(prompt_tokens) / len(prompt_tokens)),
+        'stages': stages.rows,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, nargs='+', default=[10, 100, 500],
+                        help="corpus sizes in pages, one run each")
+    parser.add_argument('--files', type=int, default=2, help="PDFs the pages are split across")
+    parser.add_argument('--questions', type=int, default=5)
+    args = parser.parse_args(argv)
+    print(json.dumps([run(pages, args.files, args.questions) for pages in args.pages], indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Time one chat rerun as the history grows
+
+    python -m benchmarks.render_history [--turns 200] [--repeat 20]
+
+Compares the cached, paginated renderer in chat_render with re-rendering every
+message on every rerun (the old behaviour) and prints JSON, one row per
+history length.
+"""
+import argparse
+import json
+import time
+
+from chat_render import history_html
+from htmlTempletes import bot_template, user_template
+
+ANSWER = ("Summary: parents may attend ARD committee meetings remotely (34 CFR, §300.322). " * 20).strip()
+
+
+def _full_render(messages):
+    parts = []
+    for message in messages:
+        template = user_template if message["role"] == "user" else bot_template
+        parts.append(template.replace("{{MSG}}", message["content"]))
+    return "".join(parts)
+
+
+def run(turns, repeat, checkpoints):
+    messages = []
+    cache = []
+    rows = []
+    for turn in range(1, turns + 1):
+        messages.append({"role": "user", "content": f"Question {turn}: can parents attend remotely?"})
+        messages.append({"role": "assistant", "content": ANSWER})
+        # the first rerun after a turn renders the two new messages
+        t0 = time.perf_counter()
+        history_html(messages, cache, user_template, bot_template)
+        first = time.perf_counter() - t0
+        if turn not in checkpoints:
+            continue
+        # steady-state reruns (button clicks, widget changes) hit the cache only
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            history_html(messages, cache, user_template, bot_template)
+        cached = (time.perf_counter() - t0) / repeat
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            _full_render(messages)
+        full = (time.perf_counter() - t0) / repeat
+        rows.append({
+            "turns": turn,
+            "messages": len(messages),
+            "new_turn_ms": round(first * 1000, 4),
+            "cached_rerun_ms": round(cached * 1000, 4),
+            "full_rerender_ms": round(full * 1000, 4),
+        })
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--turns', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+    checkpoints = {t for t in (1, 10, 25, 50, 100, 200, 500, 1000) if t <= args.turns} | {args.turns}
+    print(json.dumps(run(args.turns, args.repeat, checkpoints), indent=2))
+
+
+if __name__ == '__main__':
+    main()
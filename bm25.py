@@ -0,0 +1,59 @@
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+# Dotted section numbers such as 300.322 or 26.008 stay one token so statute
+# citations can be matched exactly.
+TOKEN_RE = re.compile(r'\d+(?:\.\d+)+[a-z]?|\w+')
+CITATION_RE = re.compile(r'\b\d+(?:\.\d+)+[a-z]?\b')
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from has have how if in is it may of on or "
+    "should that the their there this to was what when where which who will with".split())
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def citation_terms(query):
+    """Section numbers mentioned in a query, e.g. ["300.322"] for "34 CFR 300.322\""""
+    return CITATION_RE.findall(query.lower())
+
+
+class BM25Index:
+    """In-memory inverted index with Okapi BM25 scoring over a list of texts"""
+
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        self.doc_lengths = []
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            self.doc_lengths.append(sum(counts.values()))
+            for token, tf in counts.items():
+                self.postings[token].append((doc_id, tf))
+        self.avg_length = sum(self.doc_lengths) / len(self.doc_lengths) if self.doc_lengths else 0.0
+        n = len(self.doc_lengths)
+        self.idf = {token: math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                    for token, posting in self.postings.items()}
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def search(self, query, k=10):
+        """Top k (doc_id, score) pairs for the query"""
+        scores = defaultdict(float)
+        for token in set(tokenize(query)):
+            idf = self.idf.get(token)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[token]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / (self.avg_length or 1))
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def containing(self, token):
+        """Ids of documents that contain token exactly"""
+        return [doc_id for doc_id, _ in self.postings.get(token, ())]
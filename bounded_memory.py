@@ -0,0 +1,34 @@
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain_core.messages import AIMessage, HumanMessage
+
+
+class TurnWindowSummaryMemory(ConversationSummaryBufferMemory):
+    """Keep the last max_turns exchanges verbatim and summarise everything older
+
+    Older turns are folded into the rolling summary as they leave the window,
+    so the history sent with each question stays roughly constant in size.
+    """
+
+    max_turns: int = 5
+
+    def prune(self):
+        buffer = self.chat_memory.messages
+        keep = 2 * self.max_turns
+        if len(buffer) > keep:
+            pruned = buffer[:-keep]
+            del buffer[:-keep]
+            self.moving_summary_buffer = self.predict_new_summary(pruned, self.moving_summary_buffer)
+
+    def load_turns(self, turns):
+        """Seed an empty memory with (question, answer) pairs
+
+        Everything older than the window is summarised in one call, rather
+        than one call per turn as save_context would.
+        """
+        messages = [message for question, answer in turns
+                    for message in (HumanMessage(content=question), AIMessage(content=answer))]
+        keep = 2 * self.max_turns
+        if len(messages) > keep:
+            self.moving_summary_buffer = self.predict_new_summary(messages[:-keep], self.moving_summary_buffer)
+            messages = messages[-keep:]
+        self.chat_memory.messages.extend(messages)
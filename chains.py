@@ -0,0 +1,58 @@
+from functools import lru_cache
+
+from prompts import general_prompt, general_citation, engagedlow_student_prompt, engagedchild_student_prompt
+
+STUDENT_PROMPTS = {
+    'General': general_prompt,
+    'General with citation': general_citation,
+    'Engaged Low': engagedlow_student_prompt,
+    'Engaged Child': engagedchild_student_prompt,
+}
+
+
+@lru_cache(maxsize=None)
+def answer_prompt(student_type):
+    """The student type's system prompt plus the question, parsed once per process"""
+    from langchain.prompts.chat import (ChatPromptTemplate, HumanMessagePromptTemplate,
+                                        SystemMessagePromptTemplate)
+
+    return ChatPromptTemplate(input_variables=['context', 'question', 'chat_history'], messages=[
+        SystemMessagePromptTemplate.from_template(STUDENT_PROMPTS[student_type]()),
+        HumanMessagePromptTemplate.from_template("{question}"),
+    ])
+
+
+@lru_cache(maxsize=None)
+def document_prompt():
+    # prefix every chunk in the context with where it came from
+    from langchain_core.prompts import PromptTemplate
+
+    return PromptTemplate(input_variables=['page_content', 'citation'], template="[{citation}]\n{page_content}")
+
+
+def build_answer_chain(llm, student_type):
+    """Chain skeleton for one model and student type: stuffs the context and asks the model
+
+    Holds no memory or retriever, so one instance can serve every session.
+    Returns (combine_docs_chain, question_generator).
+    """
+    from langchain.chains import LLMChain, StuffDocumentsChain
+    from questionmaker import NoOpLLMChain
+
+    combine_docs_chain = StuffDocumentsChain(llm_chain=LLMChain(llm=llm, prompt=answer_prompt(student_type)),
+                                             document_variable_name='context',
+                                             document_prompt=document_prompt())
+    # questions go to the retriever as asked, with no condensing call
+    return combine_docs_chain, NoOpLLMChain(llm=llm)
+
+
+def build_conversation_chain(skeleton, retriever, memory):
+    """Attach a session's retriever and memory to a cached chain skeleton"""
+    from langchain.chains import ConversationalRetrievalChain
+
+    combine_docs_chain, question_generator = skeleton
+    return ConversationalRetrievalChain(combine_docs_chain=combine_docs_chain,
+                                        question_generator=question_generator,
+                                        retriever=retriever,
+                                        memory=memory,
+                                        return_source_documents=True)
@@ -0,0 +1,29 @@
+# Chat history rendering with a per-message HTML cache. Messages are
+# {"role": ..., "content": ...} dicts and are only ever appended, so each
+# rerun renders just the new messages and emits only the newest page of
+# history; older pages are shown on request.
+HISTORY_PAGE_SIZE = 20
+
+
+def render_message(message, user_template, bot_template):
+    template = user_template if message["role"] == "user" else bot_template
+    return template.replace("{{MSG}}", message["content"])
+
+
+def history_html(messages, cache, user_template, bot_template, visible=HISTORY_PAGE_SIZE):
+    """HTML for the newest `visible` messages, reusing cached renders
+
+    cache is a list owned by the caller (e.g. kept in session state) holding
+    (message, html) pairs in the same order as messages.
+    """
+    # the cache is stale if the history was cleared or replaced
+    if len(cache) > len(messages) or (cache and cache[-1][0] is not messages[len(cache) - 1]):
+        cache.clear()
+    for message in messages[len(cache):]:
+        cache.append((message, render_message(message, user_template, bot_template)))
+    start = max(0, len(cache) - visible)
+    return "".join(html for _, html in cache[start:])
+
+
+def hidden_count(messages, visible=HISTORY_PAGE_SIZE):
+    return max(0, len(messages) - visible)
@@ -0,0 +1,86 @@
+import re
+from collections import namedtuple
+
+# Line-based chunker that keeps provenance. Chunks never span two files and
+# carry the source filename, page range and nearest section heading, tracked
+# as lines stream past rather than by searching the text afterwards.
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+# bump whenever chunk boundaries or metadata change so cached indexes are rebuilt
+CHUNKER_VERSION = 1
+
+HEADING_RE = re.compile(r'^\s*(?:§+\s*|Sec(?:tion|\.)\s+)(\d+[A-Za-z]?(?:\.\d+[A-Za-z]?)*)')
+
+# heading is the section this line opens, section the one in force at this line
+_Line = namedtuple('_Line', ['source', 'page_no', 'heading', 'section', 'text'])
+
+
+def section_heading(line):
+    """Return the section a line opens, e.g. "§300.322", or None"""
+    match = HEADING_RE.match(line)
+    if match:
+        return "§" + match.group(1)
+    return None
+
+
+def format_citation(metadata):
+    start, end = metadata['page_start'], metadata['page_end']
+    pages = f"p. {start}" if start == end else f"pp. {start}-{end}"
+    citation = f"{metadata['source']}, {pages}"
+    if metadata['section']:
+        citation += f", {metadata['section']}"
+    return citation
+
+
+def _chunk(lines):
+    # the section in force at the first line plus any opened inside the chunk
+    sections = [lines[0].section] + [line.heading for line in lines[1:]]
+    sections = list(dict.fromkeys(section for section in sections if section))
+    metadata = {
+        'source': lines[0].source,
+        'page_start': lines[0].page_no,
+        'page_end': lines[-1].page_no,
+        'section': ", ".join(sections),
+    }
+    metadata['citation'] = format_citation(metadata)
+    return "\n".join(line.text for line in lines), metadata
+
+
+def iter_chunks(pages, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Yield (text, metadata) chunks from PageText records"""
+    buffer = []
+    length = 0
+    source = None
+    section = None
+    for page in pages:
+        if page.source != source:
+            if buffer:
+                yield _chunk(buffer)
+            buffer, length, source, section = [], 0, page.source, None
+        for text in (page.text or "").split("\n"):
+            if not text.strip():
+                continue
+            heading = section_heading(text)
+            if heading:
+                section = heading
+            if buffer and length + len(text) + 1 > chunk_size:
+                yield _chunk(buffer)
+                # keep trailing lines as overlap for the next chunk
+                kept = []
+                kept_length = 0
+                for line in reversed(buffer):
+                    if kept_length + len(line.text) + 1 > chunk_overlap:
+                        break
+                    kept.append(line)
+                    kept_length += len(line.text) + 1
+                buffer, length = kept[::-1], kept_length
+            buffer.append(_Line(page.source, page.page_no, heading, section, text))
+            length += len(text) + 1
+    if buffer:
+        yield _chunk(buffer)
+
+
+def to_documents(chunks):
+    from langchain_core.documents import Document
+
+    return [Document(page_content=text, metadata=metadata) for text, metadata in chunks]
@@ -0,0 +1,47 @@
+from tokens import count_tokens
+
+# Lines shorter than this (blank, page numbers, "Summary:") are common to many
+# chunks and never treated as duplicates.
+MIN_DUPLICATE_LINE = 20
+# drop a chunk outright when this share of its lines was already included
+NEAR_DUPLICATE_RATIO = 0.8
+
+
+def assemble_context(scored_docs, token_budget, model="gpt-3.5-turbo"):
+    """Pack the best chunks into token_budget tokens
+
+    scored_docs is a list of (relevance, Document) pairs. Chunks are taken in
+    order of relevance; lines already included through an overlapping chunk
+    are cut, near-duplicate chunks are dropped, and chunks that no longer fit
+    the budget are skipped. Returns the kept Documents and a stats dict.
+    """
+    from langchain_core.documents import Document
+
+    seen_lines = set()
+    kept = []
+    used = 0
+    retrieved_tokens = 0
+    for _, doc in sorted(scored_docs, key=lambda pair: pair[0], reverse=True):
+        lines = doc.page_content.split("\n")
+        retrieved_tokens += count_tokens(doc.page_content, model)
+        long_lines = [line for line in lines if len(line) >= MIN_DUPLICATE_LINE]
+        repeated = sum(1 for line in long_lines if line in seen_lines)
+        if long_lines and repeated / len(long_lines) >= NEAR_DUPLICATE_RATIO:
+            continue
+        if repeated:
+            lines = [line for line in lines if len(line) < MIN_DUPLICATE_LINE or line not in seen_lines]
+            doc = Document(page_content="\n".join(lines), metadata=doc.metadata)
+        tokens = count_tokens(doc.page_content, model)
+        if used + tokens > token_budget:
+            continue
+        used += tokens
+        seen_lines.update(long_lines)
+        kept.append(doc)
+    stats = {
+        'retrieved': len(scored_docs),
+        'kept': len(kept),
+        'retrieved_tokens': retrieved_tokens,
+        'context_tokens': used,
+        'tokens_saved': retrieved_tokens - used,
+    }
+    return kept, stats
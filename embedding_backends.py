@@ -0,0 +1,119 @@
+import json
+import os
+from functools import lru_cache
+
+from langchain_core.embeddings import Embeddings
+
+from embedding_cache import CachedEmbeddings
+
+# 'openai' sends chunks to the OpenAI embeddings API; 'local' hashes word and
+# character n-grams on local CPUs, needs no network or API key, and has no
+# rate limits. Indexes remember which backend built them (see
+# write_index_metadata) and refuse queries embedded by a different one.
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'openai')
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-ada-002')
+LOCAL_EMBEDDING_DIM = 384
+LOCAL_EMBEDDING_JOBS = int(os.getenv('LOCAL_EMBEDDING_JOBS', str(os.cpu_count() or 1)))
+LOCAL_EMBEDDING_BATCH = 512
+METADATA_NAME = 'embedding.json'
+# indexes saved before backends were recorded were all built with OpenAI
+LEGACY_IDENTITY = 'text-embedding-ada-002'
+
+
+class EmbeddingMismatchError(ValueError):
+    pass
+
+
+class LocalHashingEmbeddings(Embeddings):
+    """CPU-only embeddings: hashed word and character n-grams, randomly projected
+
+    Stateless, so documents and queries embed the same way in any process
+    without a fitted model on disk. Batches are spread over local cores.
+    """
+
+    def __init__(self, dim=LOCAL_EMBEDDING_DIM, n_jobs=LOCAL_EMBEDDING_JOBS):
+        from scipy.sparse import csr_matrix, hstack
+        from sklearn.feature_extraction.text import HashingVectorizer
+        from sklearn.random_projection import SparseRandomProjection
+
+        self.dim = dim
+        self.n_jobs = n_jobs
+        self._hstack = hstack
+        self._words = HashingVectorizer(ngram_range=(1, 2), n_features=2 ** 18, alternate_sign=False,
+                                        token_pattern=r'(?u)\b\w[\w.]*\b')
+        self._chars = HashingVectorizer(analyzer='char_wb', ngram_range=(3, 5), n_features=2 ** 18,
+                                        alternate_sign=False)
+        # fitting only reads the input width, so the projection is fixed by random_state
+        self._projection = SparseRandomProjection(n_components=dim, dense_output=True, random_state=0)
+        self._projection.fit(csr_matrix((1, 2 * 2 ** 18)))
+
+    @property
+    def model_name(self):
+        return f"local-hashing-{self.dim}"
+
+    def _embed_batch(self, texts):
+        from sklearn.preprocessing import normalize
+
+        features = self._hstack([self._words.transform(texts), self._chars.transform(texts)]).tocsr()
+        return normalize(self._projection.transform(features)).tolist()
+
+    def embed_documents(self, texts):
+        batches = [texts[i:i + LOCAL_EMBEDDING_BATCH] for i in range(0, len(texts), LOCAL_EMBEDDING_BATCH)]
+        if self.n_jobs <= 1 or len(batches) <= 1:
+            results = [self._embed_batch(batch) for batch in batches]
+        else:
+            from joblib import Parallel, delayed
+
+            results = Parallel(n_jobs=self.n_jobs)(delayed(self._embed_batch)(batch) for batch in batches)
+        return [vector for batch in results for vector in batch]
+
+    def embed_query(self, text):
+        return self._embed_batch([text])[0]
+
+
+@lru_cache(maxsize=None)
+def _backend_embeddings(backend):
+    # built once per process: the local projection takes over a second to set up
+    if backend == 'openai':
+        from langchain_community.embeddings import OpenAIEmbeddings
+
+        return OpenAIEmbeddings(model=EMBEDDING_MODEL)
+    if backend == 'local':
+        return LocalHashingEmbeddings()
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+
+def get_embeddings(backend=EMBEDDING_BACKEND):
+    """Embeddings for the configured backend, behind the local embedding cache
+
+    The backend is shared per process; each call gets its own cache wrapper,
+    so its hit and miss counts cover only what the caller embedded.
+    """
+    return CachedEmbeddings(_backend_embeddings(backend), embedding_identity(backend))
+
+
+def embedding_identity(backend=EMBEDDING_BACKEND):
+    """Name recorded with indexes and cache entries for the backend's vectors"""
+    if backend == 'openai':
+        return EMBEDDING_MODEL
+    if backend == 'local':
+        return f"local-hashing-{LOCAL_EMBEDDING_DIM}"
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+
+def write_index_metadata(folder, embeddings):
+    with open(os.path.join(folder, METADATA_NAME), 'w') as f:
+        json.dump({'embeddings': embeddings.model_name}, f)
+
+
+def check_index_metadata(folder, embeddings):
+    """Raise EmbeddingMismatchError if the index at folder was built by another backend"""
+    path = os.path.join(folder, METADATA_NAME)
+    built_with = LEGACY_IDENTITY
+    if os.path.isfile(path):
+        with open(path) as f:
+            built_with = json.load(f)['embeddings']
+    if built_with != embeddings.model_name:
+        raise EmbeddingMismatchError(
+            f"index at {folder} was built with '{built_with}' embeddings, "
+            f"but queries would use '{embeddings.model_name}'")
@@ -0,0 +1,82 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+# Local SQLite cache of chunk embeddings keyed by (model, sha256 of chunk text),
+# so only chunks that were never embedded before go to the embedding backend.
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.embedding_cache.sqlite'))
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '256'))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv('EMBEDDING_MAX_CONCURRENCY', '4'))
+
+
+def _text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that serves repeated chunks from the local cache"""
+
+    def __init__(self, embeddings, model_name, path=EMBEDDING_CACHE_PATH,
+                 batch_size=EMBEDDING_BATCH_SIZE, max_concurrency=EMBEDDING_MAX_CONCURRENCY):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.path = path
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("CREATE TABLE IF NOT EXISTS embeddings ("
+                     "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+                     "PRIMARY KEY (model, text_hash))")
+        return conn
+
+    def _lookup(self, conn, hashes):
+        found = {}
+        hashes = list(hashes)
+        # stay under SQLite's bound-parameter limit
+        for start in range(0, len(hashes), 500):
+            part = hashes[start:start + 500]
+            placeholders = ",".join("?" * len(part))
+            rows = conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                [self.model_name, *part])
+            for text_hash, blob in rows:
+                found[text_hash] = array('f', blob).tolist()
+        return found
+
+    def embed_documents(self, texts):
+        hashes = [_text_hash(text) for text in texts]
+        # deduplicate before touching the cache or the backend
+        unique = dict(zip(hashes, texts))
+        conn = self._connect()
+        try:
+            vectors = self._lookup(conn, unique)
+            missing = [h for h in unique if h not in vectors]
+            batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+            with ThreadPoolExecutor(max_workers=max(1, self.max_concurrency)) as pool:
+                results = pool.map(lambda batch: self.embeddings.embed_documents([unique[h] for h in batch]), batches)
+                for batch, batch_vectors in zip(batches, results):
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                        [(self.model_name, h, array('f', v).tobytes()) for h, v in zip(batch, batch_vectors)])
+                    conn.commit()
+                    vectors.update(zip(batch, batch_vectors))
+        finally:
+            conn.close()
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        return [list(vectors[h]) for h in hashes]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
@@ -0,0 +1,201 @@
+"""Compressed and approximate FAISS index types for large corpora
+
+LangChain's FAISS store always builds an exact IndexFlatL2 holding every
+float32 vector. Past a few tens of thousands of chunks that costs more memory
+than a small replica has, so the index can be converted once built:
+
+    flat     exact search over raw vectors (LangChain's default)
+    hnsw     graph search over raw vectors; fastest queries, most memory
+    ivf      inverted lists over raw vectors; probes INDEX_NPROBE lists
+    ivf-sq8  inverted lists over 8-bit scalar-quantized vectors (4x smaller)
+    ivf-pq   inverted lists over product-quantized vectors (~32x smaller)
+
+INDEX_TYPE=auto picks by corpus size. Conversion happens after the store is
+built, and stores are made flat again (to_flat) before chunks are deleted or
+added. Saved indexes are memory-mapped on load where FAISS supports it (the
+inverted-list types), so replicas page in only the lists they probe. See
+benchmarks/index_types.py for recall vs latency.
+"""
+import math
+import os
+import pickle
+
+INDEX_TYPE = os.getenv('INDEX_TYPE', 'auto')
+INDEX_TYPES = ['flat', 'hnsw', 'ivf', 'ivf-sq8', 'ivf-pq']
+# auto: exact search while it is cheap, then 4x, then ~32x compression
+FLAT_MAX_VECTORS = int(os.getenv('FLAT_MAX_VECTORS', '20000'))
+SQ8_MAX_VECTORS = int(os.getenv('SQ8_MAX_VECTORS', '200000'))
+INDEX_NPROBE = int(os.getenv('INDEX_NPROBE', '16'))
+INDEX_EF_SEARCH = int(os.getenv('INDEX_EF_SEARCH', '64'))
+HNSW_M = 32
+# FAISS wants about 39 training points per centroid, and 256 centroids per PQ sub-quantizer
+MIN_POINTS_PER_CENTROID = 39
+PQ_CENTROIDS = 256
+# centroids are trained on a sample of at most this many vectors
+MAX_TRAINING_POINTS = 100000
+
+
+def choose_index_type(ntotal):
+    if ntotal <= FLAT_MAX_VECTORS:
+        return 'flat'
+    if ntotal <= SQ8_MAX_VECTORS:
+        return 'ivf-sq8'
+    return 'ivf-pq'
+
+
+def resolve_index_type(index_type, ntotal):
+    """The concrete type for index_type ('auto' or one of INDEX_TYPES) at this corpus size
+
+    Inverted-list types need enough vectors to train their centroids; smaller
+    corpora fall back to flat.
+    """
+    if index_type == 'auto':
+        index_type = choose_index_type(ntotal)
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}")
+    if index_type.startswith('ivf') and ntotal < MIN_POINTS_PER_CENTROID * 16:
+        return 'flat'
+    if index_type == 'ivf-pq' and ntotal < MIN_POINTS_PER_CENTROID * PQ_CENTROIDS:
+        return 'ivf-sq8'
+    return index_type
+
+
+def _pq_subquantizers(dim):
+    # ~8 dimensions per one-byte code, and it must divide the dimension
+    m = max(1, dim // 8)
+    while dim % m:
+        m -= 1
+    return m
+
+
+def factory_string(index_type, dim, ntotal):
+    if index_type == 'flat':
+        return 'Flat'
+    if index_type == 'hnsw':
+        return f'HNSW{HNSW_M}'
+    nlist = max(16, min(int(4 * math.sqrt(ntotal)), ntotal // MIN_POINTS_PER_CENTROID))
+    codes = {'ivf': 'Flat', 'ivf-sq8': 'SQ8', 'ivf-pq': f'PQ{_pq_subquantizers(dim)}'}[index_type]
+    return f'IVF{nlist},{codes}'
+
+
+def index_type_of(index):
+    import faiss
+
+    name = type(faiss.downcast_index(index)).__name__
+    if name.startswith('IndexHNSW'):
+        return 'hnsw'
+    if name == 'IndexIVFFlat':
+        return 'ivf'
+    if name == 'IndexIVFScalarQuantizer':
+        return 'ivf-sq8'
+    if name == 'IndexIVFPQ':
+        return 'ivf-pq'
+    return 'flat'
+
+
+def tune(index, nprobe=INDEX_NPROBE, ef_search=INDEX_EF_SEARCH):
+    """Apply the search-time settings, which are not all kept by write_index"""
+    import faiss
+
+    index_type = index_type_of(index)
+    if index_type.startswith('ivf'):
+        ivf = faiss.extract_index_ivf(index)
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    elif index_type == 'hnsw':
+        faiss.downcast_index(index).hnsw.efSearch = ef_search
+    return index
+
+
+def build_index(vectors, index_type):
+    """Train and fill a new index of index_type over a float32 (n, dim) array"""
+    import faiss
+
+    ntotal, dim = vectors.shape
+    index = faiss.index_factory(dim, factory_string(index_type, dim, ntotal), faiss.METRIC_L2)
+    if not index.is_trained:
+        sample = vectors
+        if ntotal > MAX_TRAINING_POINTS:
+            import numpy as np
+
+            sample = vectors[np.random.default_rng(0).choice(ntotal, MAX_TRAINING_POINTS, replace=False)]
+        index.train(sample)
+    index.add(vectors)
+    return tune(index)
+
+
+def stored_vectors(index):
+    """Every vector in the index as a float32 array; approximate for quantized types"""
+    import faiss
+
+    if index_type_of(index).startswith('ivf'):
+        faiss.extract_index_ivf(index).make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def convert(vectorstore, index_type):
+    """Swap a LangChain FAISS store's index for index_type, keeping ids and docstore
+
+    Positions are preserved, so index_to_docstore_id stays valid.
+    """
+    if index_type_of(vectorstore.index) == index_type:
+        return vectorstore
+    vectorstore.index = build_index(stored_vectors(vectorstore.index), index_type)
+    return vectorstore
+
+
+def to_flat(vectorstore, embeddings):
+    """Rebuild a store's index as exact flat vectors by re-embedding its chunks
+
+    LangChain's FAISS.delete assumes positions shift down after a removal,
+    which only the flat index does, and quantized vectors cannot be recovered
+    exactly, so compressed stores are made flat again before editing. With
+    the embedding cache this costs no embedding calls.
+    """
+    import faiss
+    import numpy as np
+
+    if index_type_of(vectorstore.index) == 'flat':
+        return vectorstore
+    texts = [vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]).page_content
+             for i in range(len(vectorstore.index_to_docstore_id))]
+    vectors = np.array(embeddings.embed_documents(texts), dtype=np.float32)
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    vectorstore.index = index
+    return vectorstore
+
+
+def load_vectorstore(folder, embeddings, mmap=True):
+    """FAISS.load_local, but memory-mapping the index file when FAISS can
+
+    Memory-mapped inverted lists are read-only; pass mmap=False to modify the
+    store.
+    """
+    import faiss
+    from langchain_community.vectorstores import FAISS
+    from retrieval import load_keyword_index
+
+    path = os.path.join(folder, 'index.faiss')
+    index = None
+    if mmap:
+        try:
+            index = faiss.read_index(path, faiss.IO_FLAG_MMAP)
+        except RuntimeError:
+            # this index type cannot be mapped
+            index = None
+    if index is None:
+        index = faiss.read_index(path)
+    with open(os.path.join(folder, 'index.pkl'), 'rb') as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    vectorstore = FAISS(embeddings, tune(index), docstore, index_to_docstore_id)
+    # indexes saved before keyword indexes were stored build theirs on first search
+    load_keyword_index(vectorstore, folder)
+    return vectorstore
+
+
+def save_vectorstore(vectorstore, folder):
+    """FAISS.save_local, plus the store's BM25 index so replicas need not build it"""
+    from retrieval import save_keyword_index
+
+    vectorstore.save_local(folder)
+    save_keyword_index(vectorstore, folder)
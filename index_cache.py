@@ -0,0 +1,105 @@
+import hashlib
+import os
+import shutil
+import time
+import uuid
+
+# On-disk FAISS index store keyed by the uploaded file bytes plus the chunking
+# parameters, so processing the same PDFs again loads the saved index instead
+# of re-embedding every chunk.
+INDEX_CACHE_DIR = os.getenv('INDEX_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.index_cache'))
+INDEX_CACHE_MAX_MB = int(os.getenv('INDEX_CACHE_MAX_MB', '1024'))
+
+
+def _file_bytes(pdf):
+    if hasattr(pdf, 'getvalue'):
+        return pdf.getvalue()
+    data = pdf.read()
+    pdf.seek(0)
+    return data
+
+
+def file_hash(pdf):
+    return hashlib.sha256(_file_bytes(pdf)).hexdigest()
+
+
+def index_key(pdf_docs, **params):
+    """Content hash of the uploaded files plus the parameters used to build the index"""
+    file_hashes = sorted(file_hash(pdf) for pdf in pdf_docs)
+    h = hashlib.sha256()
+    for digest in file_hashes:
+        h.update(digest.encode())
+    for name in sorted(params):
+        h.update(f"{name}={params[name]}".encode())
+    return h.hexdigest()
+
+
+def _entry_path(key):
+    return os.path.join(INDEX_CACHE_DIR, key)
+
+
+def load_index(key, embeddings, mmap=True):
+    """Return the cached FAISS index for key, or None on a miss; pass mmap=False to modify it"""
+    from embedding_backends import check_index_metadata
+    from faiss_index import load_vectorstore
+
+    path = _entry_path(key)
+    if not os.path.isdir(path):
+        return None
+    check_index_metadata(path, embeddings)
+    vectorstore = load_vectorstore(path, embeddings, mmap=mmap)
+    # mtime doubles as the LRU timestamp
+    os.utime(path)
+    return vectorstore
+
+
+def save_index(key, vectorstore, embeddings):
+    """Write the index under key atomically and evict old entries over the size limit"""
+    from embedding_backends import write_index_metadata
+    from faiss_index import save_vectorstore
+
+    os.makedirs(INDEX_CACHE_DIR, exist_ok=True)
+    path = _entry_path(key)
+    tmp_path = os.path.join(INDEX_CACHE_DIR, f".tmp-{key}-{uuid.uuid4().hex}")
+    save_vectorstore(vectorstore, tmp_path)
+    write_index_metadata(tmp_path, embeddings)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # another session stored the same key first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    evict(INDEX_CACHE_MAX_MB * 1024 * 1024)
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def evict(max_bytes):
+    """Remove least recently used entries until the store fits in max_bytes"""
+    if not os.path.isdir(INDEX_CACHE_DIR):
+        return
+    entries = []
+    for name in os.listdir(INDEX_CACHE_DIR):
+        path = os.path.join(INDEX_CACHE_DIR, name)
+        if not os.path.isdir(path):
+            continue
+        if name.startswith('.tmp-'):
+            # leftovers from a crashed write
+            if time.time() - os.path.getmtime(path) > 3600:
+                shutil.rmtree(path, ignore_errors=True)
+            continue
+        entries.append((os.path.getmtime(path), _dir_size(path), path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
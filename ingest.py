@@ -0,0 +1,214 @@
+"""Build or update a FAISS index from a directory of PDFs, outside the app
+
+    python -m ingest path/to/pdfs [--index shared_index] [--rebuild] [--backend local] [--index-type auto]
+
+Only files that are new or changed since the last run are extracted and
+embedded; chunks of deleted or changed files are removed by id. The index is
+written next to a manifest.json recording every file's hash and chunk count.
+Point SHARED_INDEX_DIR at the output and restart the app to serve it.
+
+--index-type (default INDEX_TYPE, i.e. auto) compresses large corpora, see
+faiss_index. A compressed index is expanded to flat vectors from the
+embedding cache before it is updated, and compressed again before saving.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+from chunking import CHUNK_SIZE, CHUNK_OVERLAP, CHUNKER_VERSION, iter_chunks, to_documents
+from faiss_index import (INDEX_TYPE, INDEX_TYPES, convert, load_vectorstore, resolve_index_type, save_vectorstore,
+                         to_flat)
+from pdf_extract import PdfPath, iter_pdf_pages
+
+MANIFEST_NAME = 'manifest.json'
+# changed files extracted and embedded together; bounds the chunks held at once
+INGEST_BATCH_FILES = 32
+DEFAULT_INDEX_DIR = os.getenv('SHARED_INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shared_index'))
+
+
+def index_params(embeddings):
+    return {
+        'chunk_size': CHUNK_SIZE,
+        'chunk_overlap': CHUNK_OVERLAP,
+        'chunker': CHUNKER_VERSION,
+        'embeddings': embeddings.model_name,
+    }
+
+
+def load_manifest(index_dir):
+    path = os.path.join(index_dir, MANIFEST_NAME)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, index_dir):
+    """Replace just the manifest, e.g. to record new mtimes of unchanged files"""
+    path = os.path.join(index_dir, MANIFEST_NAME)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def find_pdfs(source_dir):
+    """Relative paths of every PDF under source_dir, sorted"""
+    found = []
+    for root, _, files in os.walk(source_dir):
+        for name in files:
+            if name.lower().endswith('.pdf'):
+                found.append(os.path.relpath(os.path.join(root, name), source_dir))
+    return sorted(found)
+
+
+def chunk_ids(name, count):
+    return [f"{name}#{i}" for i in range(count)]
+
+
+def split_by_source(docs, names):
+    """{name: (docs, ids)} for chunks of several files; chunks never span files"""
+    grouped = {name: [] for name in names}
+    for doc in docs:
+        grouped[doc.metadata['source']].append(doc)
+    return {name: (file_docs, chunk_ids(name, len(file_docs))) for name, file_docs in grouped.items()}
+
+
+def files_documents(pdfs):
+    """Chunk several PdfPath files in one extraction pass, so their pages share the process pool"""
+    docs = to_documents(iter_chunks(iter_pdf_pages(pdfs), CHUNK_SIZE, CHUNK_OVERLAP))
+    return split_by_source(docs, [pdf.name for pdf in pdfs])
+
+
+def save_atomic(vectorstore, embeddings, manifest, index_dir):
+    """Write index and manifest to a temp dir, then swap it into place"""
+    from embedding_backends import write_index_metadata
+
+    parent = os.path.dirname(os.path.abspath(index_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = f"{index_dir}.tmp-{os.getpid()}"
+    save_vectorstore(vectorstore, tmp_dir)
+    write_index_metadata(tmp_dir, embeddings)
+    with open(os.path.join(tmp_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    old_dir = f"{index_dir}.old-{os.getpid()}"
+    if os.path.isdir(index_dir):
+        os.rename(index_dir, old_dir)
+    os.rename(tmp_dir, index_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def ingest(source_dir, index_dir=DEFAULT_INDEX_DIR, rebuild=False, backend=None, log=print, index_type=INDEX_TYPE):
+    """Bring the index at index_dir up to date with the PDFs in source_dir
+
+    Returns the updated store, or None when nothing was written.
+    """
+    from langchain_community.vectorstores import FAISS
+    from embedding_backends import check_index_metadata, get_embeddings
+
+    embeddings = get_embeddings(backend) if backend else get_embeddings()
+    params = index_params(embeddings)
+    manifest = None if rebuild else load_manifest(index_dir)
+    if manifest is not None and manifest.get('params') != params:
+        log("Chunking or embedding settings changed, rebuilding from scratch")
+        manifest = None
+    files = manifest['files'] if manifest is not None else {}
+
+    current = find_pdfs(source_dir)
+    stale_ids = []
+    for name in sorted(set(files) - set(current)):
+        log(f"removed  {name}")
+        stale_ids.extend(chunk_ids(name, files.pop(name)['chunks']))
+
+    changed = []
+    for name in current:
+        path = os.path.join(source_dir, name)
+        stat = os.stat(path)
+        entry = files.get(name)
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        if entry and entry['sha256'] == digest:
+            entry['mtime'] = stat.st_mtime
+            continue
+        if entry:
+            stale_ids.extend(chunk_ids(name, entry['chunks']))
+        changed.append((name, path, {'sha256': digest, 'size': stat.st_size, 'mtime': stat.st_mtime}, entry))
+
+    if manifest is not None and not stale_ids and not changed:
+        target = resolve_index_type(index_type, sum(entry['chunks'] for entry in files.values()))
+        if target == manifest.get('index_type'):
+            # rewriting index.faiss would bump the shared index version and
+            # start every new session with cold answer and retrieval caches
+            save_manifest(manifest, index_dir)
+            log(f"{len(files)} files, no changes; index left as it was")
+            return None
+
+    vectorstore = None
+    if manifest is not None:
+        check_index_metadata(index_dir, embeddings)
+        # chunks can only be removed and added exactly on a flat index
+        vectorstore = to_flat(load_vectorstore(index_dir, embeddings, mmap=False), embeddings)
+
+    added = 0
+    # a group of files is extracted together so small files still run in parallel
+    for group_start in range(0, len(changed), INGEST_BATCH_FILES):
+        group = changed[group_start:group_start + INGEST_BATCH_FILES]
+        t0 = time.perf_counter()
+        documents = files_documents([PdfPath(name, path) for name, path, _, _ in group])
+        if stale_ids and vectorstore is not None:
+            vectorstore.delete(stale_ids)
+            stale_ids = []
+        for name, _, record, entry in group:
+            docs, ids = documents[name]
+            if docs:
+                if vectorstore is None:
+                    vectorstore = FAISS.from_documents(docs, embeddings, ids=ids)
+                else:
+                    vectorstore.add_documents(docs, ids=ids)
+            files[name] = dict(record, chunks=len(docs))
+            added += len(docs)
+            log(f"{'updated' if entry else 'added'}  {name}: {len(docs)} chunks")
+        log(f"indexed {len(group)} files in {time.perf_counter() - t0:.1f}s")
+
+    if stale_ids and vectorstore is not None:
+        vectorstore.delete(stale_ids)
+    if vectorstore is None:
+        log("No text found, nothing written")
+        return None
+    target = resolve_index_type(index_type, vectorstore.index.ntotal)
+    if target != 'flat':
+        t0 = time.perf_counter()
+        vectorstore = convert(vectorstore, target)
+        log(f"converted to {target} in {time.perf_counter() - t0:.1f}s")
+    save_atomic(vectorstore, embeddings, {'params': params, 'files': files, 'index_type': target,
+                                          'updated': time.time()}, index_dir)
+    log(f"{len(files)} files, {vectorstore.index.ntotal} chunks ({added} new) in a {target} index; "
+        f"embedding cache {embeddings.hits} hits, {embeddings.misses} misses")
+    return vectorstore
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or update the shared corpus index from a directory of PDFs")
+    parser.add_argument('source_dir', help="directory searched recursively for PDFs")
+    parser.add_argument('--index', default=DEFAULT_INDEX_DIR, help="index directory (default: %(default)s)")
+    parser.add_argument('--rebuild', action='store_true', help="ignore the manifest and re-index every file")
+    parser.add_argument('--backend', choices=['openai', 'local'],
+                        help="embedding backend (default: EMBEDDING_BACKEND or openai)")
+    parser.add_argument('--index-type', choices=['auto'] + INDEX_TYPES, default=INDEX_TYPE,
+                        help="FAISS index type; auto picks by corpus size (default: %(default)s)")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.source_dir):
+        parser.error(f"{args.source_dir} is not a directory")
+    ingest(args.source_dir, args.index, args.rebuild, args.backend, index_type=args.index_type)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""Deferred imports for the LangChain/FAISS stack, with an import-time report
+
+app.py only checks at startup that these packages are installed and imports
+them where they are used, so the Streamlit shell paints before ~3s of
+LangChain imports. preload() warms them on a background thread meanwhile.
+
+    python -m lazy_imports    # cold import time of each module, as JSON
+"""
+import importlib
+import importlib.util
+import json
+import sys
+import threading
+import time
+
+# the chain and ingestion subsystems, roughly in the order they are first needed
+HEAVY_MODULES = [
+    'embedding_backends',
+    'langchain_community.vectorstores',
+    'retrieval',
+    'langchain_community.chat_models',
+    'stream_handler',
+    'langchain.chains',
+    'langchain.memory',
+    'bounded_memory',
+    'questionmaker',
+    'chains',
+]
+
+IMPORT_TIMES = {}
+_lock = threading.Lock()
+
+
+def installed(*names):
+    """True if every top-level package can be found, without importing it"""
+    return all(importlib.util.find_spec(name) is not None for name in names)
+
+
+def timed_import(name):
+    """Import name, recording the seconds it took the first time"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    t0 = time.perf_counter()
+    module = importlib.import_module(name)
+    with _lock:
+        # only what this import loaded itself; modules it shares with earlier ones are already counted
+        IMPORT_TIMES.setdefault(name, time.perf_counter() - t0)
+    return module
+
+
+def _preload(names):
+    for name in names:
+        try:
+            timed_import(name)
+        except Exception:
+            # the code path that needs it reports the failure
+            pass
+
+
+def preload(names=HEAVY_MODULES):
+    """Import names on a daemon thread; first use blocks only until its module is loaded"""
+    thread = threading.Thread(target=_preload, args=(list(names),), name='preload-imports', daemon=True)
+    thread.start()
+    return thread
+
+
+def import_report():
+    """(module, seconds) pairs for every timed import, slowest first"""
+    with _lock:
+        return sorted(IMPORT_TIMES.items(), key=lambda item: item[1], reverse=True)
+
+
+def main():
+    t0 = time.perf_counter()
+    _preload(HEAVY_MODULES)
+    report = {'total_seconds': round(time.perf_counter() - t0, 3),
+              'modules': {name: round(seconds, 3) for name, seconds in import_report()}}
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
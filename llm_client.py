@@ -0,0 +1,131 @@
+"""Process-wide HTTP client for OpenAI calls from both apps
+
+All chat requests share one keep-alive connection pool, one token bucket for
+requests per minute and one for tokens per minute, and one jittered retry
+policy for 429s and 5xx responses. The limits live in the HTTP transport, so
+they apply to every user of the shared openai client, including LangChain's
+ChatOpenAI (pass client=get_openai_client().chat.completions). Set
+OPENAI_BASE_URL to point everything at a local mock server for testing;
+benchmarks/mock_openai.py provides one, and checks the retry and rate limit
+paths against it.
+"""
+import json
+import os
+import random
+import threading
+import time
+
+import httpx
+
+OPENAI_RPM = int(os.getenv('OPENAI_RPM', '500'))
+OPENAI_TPM = int(os.getenv('OPENAI_TPM', '200000'))
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '20'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '5'))
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '120'))
+RETRY_STATUSES = frozenset([408, 409, 429, 500, 502, 503, 504])
+# completion budget assumed when a request does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 1000
+
+
+class TokenBucket:
+    """Blocking token bucket refilled continuously at rate_per_minute"""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        # a single request larger than the bucket would otherwise wait forever
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def estimate_tokens(content):
+    """Prompt plus completion tokens a request body may use"""
+    try:
+        body = json.loads(content or b'{}')
+    except ValueError:
+        return len(content or b'') // 4
+    completion = body.get('max_tokens') or DEFAULT_COMPLETION_TOKENS
+    return len(content) // 4 + completion
+
+
+def backoff_delay(attempt, response=None, base=0.5, cap=30.0):
+    """Full-jitter exponential backoff, honouring Retry-After when given"""
+    if response is not None:
+        retry_after = response.headers.get('retry-after')
+        if retry_after:
+            try:
+                return min(cap, float(retry_after)) + random.uniform(0, base)
+            except ValueError:
+                pass
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class RateLimitedTransport(httpx.HTTPTransport):
+    def __init__(self, requests_per_minute=OPENAI_RPM, tokens_per_minute=OPENAI_TPM,
+                 max_retries=LLM_MAX_RETRIES, **kwargs):
+        super().__init__(**kwargs)
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+
+    def handle_request(self, request):
+        request.read()
+        tokens = estimate_tokens(request.content)
+        attempt = 0
+        while True:
+            self.requests.acquire()
+            self.tokens.acquire(tokens)
+            try:
+                response = super().handle_request(request)
+            except httpx.TransportError:
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(backoff_delay(attempt))
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                response.close()
+                time.sleep(backoff_delay(attempt, response))
+            attempt += 1
+
+
+_http_client = None
+_openai_client = None
+_lock = threading.Lock()
+
+
+def get_http_client():
+    """The shared httpx client behind get_openai_client()"""
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+            _http_client = httpx.Client(transport=RateLimitedTransport(limits=limits),
+                                        limits=limits, timeout=LLM_TIMEOUT)
+        return _http_client
+
+
+def get_openai_client():
+    """Shared openai.OpenAI client; retries are left to the transport"""
+    global _openai_client
+    from openai import OpenAI
+
+    http_client = get_http_client()
+    with _lock:
+        if _openai_client is None:
+            _openai_client = OpenAI(http_client=http_client, max_retries=0)
+        return _openai_client
@@ -0,0 +1,37 @@
+import streamlit as st
+
+from admin import require_admin
+from tracing import QUANTILES, TRACE_WINDOW_HOURS, TraceStore
+
+# Admin view of the per-question spans recorded by app.py
+st.set_page_config(page_title="Chatbot metrics", page_icon=":bar_chart:", layout="wide")
+st.header("Latency by model and student type")
+require_admin()
+
+hours = st.number_input("Window (hours)", min_value=1.0, value=TRACE_WINDOW_HOURS, step=1.0)
+store = TraceStore()
+spans = store.spans(hours)
+if not spans:
+    st.info("No questions answered in this window yet.")
+    st.stop()
+
+cached = sum(1 for span in spans if span['cached'])
+errors = sum(1 for span in spans if span['status'] != 'ok')
+st.caption(f"{len(spans)} questions, {cached} answered from cache, {errors} failed")
+
+rows = []
+for (model, student_type), columns in sorted(store.summary(hours).items()):
+    for column, stats in columns.items():
+        row = {'model': model, 'student type': student_type, 'measure': column, 'count': stats['count']}
+        row.update((f"p{round(q * 100)}", round(stats[q], 3)) for q in QUANTILES)
+        rows.append(row)
+st.dataframe(rows, use_container_width=True, hide_index=True)
+
+with st.expander("Slowest questions"):
+    slowest = sorted(spans, key=lambda span: span['total_seconds'] or 0, reverse=True)[:20]
+    st.dataframe(slowest, use_container_width=True, hide_index=True)
+
+prometheus = store.prometheus_text(hours)
+st.download_button("Download Prometheus metrics", prometheus, file_name="chatbot.prom", mime="text/plain")
+with st.expander("Prometheus text"):
+    st.code(prometheus, language="text")
@@ -0,0 +1,20 @@
+import streamlit as st
+
+from admin import require_admin
+from session_store import SESSION_IDLE_SECONDS, get_session_store
+
+# Admin view of the per-session objects app.py holds in this process
+st.set_page_config(page_title="Chatbot sessions", page_icon=":busts_in_silhouette:", layout="wide")
+st.header("Session memory")
+require_admin()
+
+store = get_session_store()
+store.evict_idle()
+rows = store.report()
+st.caption(f"{len(rows)} live sessions, {store.evicted} evicted after {SESSION_IDLE_SECONDS:.0f}s idle. "
+           "Shared indexes and models are not counted.")
+if not rows:
+    st.info("No active sessions.")
+    st.stop()
+st.metric("Total", f"{sum(row['bytes'] for row in rows) / 1024 / 1024:.1f} MB")
+st.dataframe(rows, use_container_width=True, hide_index=True)
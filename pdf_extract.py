@@ -0,0 +1,91 @@
+import io
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from PyPDF2 import PdfReader
+
+# Page-level PDF text extraction. Pages are fanned out to a process pool in
+# fixed-size batches and yielded back in document order, so callers can chunk
+# text as it arrives instead of building one string for the whole upload.
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', str(os.cpu_count() or 1)))
+PAGES_PER_TASK = 16
+# forking the app would copy its threads and held locks (Streamlit's, the
+# OpenAI client's) into the workers; forkserver starts them from a clean
+# process that has already imported this module
+if 'forkserver' in multiprocessing.get_all_start_methods():
+    MP_CONTEXT = multiprocessing.get_context('forkserver')
+    MP_CONTEXT.set_forkserver_preload([__name__])
+else:
+    MP_CONTEXT = multiprocessing.get_context('spawn')
+
+PageText = namedtuple('PageText', ['source', 'page_no', 'text', 'seconds'])
+# a PDF on disk, shown as name; workers open the path themselves
+PdfPath = namedtuple('PdfPath', ['name', 'path'])
+
+
+def read_pdf_bytes(pdf):
+    if hasattr(pdf, 'getvalue'):
+        return pdf.getvalue()
+    data = pdf.read()
+    pdf.seek(0)
+    return data
+
+
+def _open(source):
+    # source is a path, or the bytes of an uploaded file
+    return PdfReader(source if isinstance(source, str) else io.BytesIO(source))
+
+
+def _extract_pages(source, start, stop):
+    reader = _open(source)
+    results = []
+    for page in reader.pages[start:stop]:
+        t0 = time.perf_counter()
+        text = page.extract_text() or ""
+        results.append((text, time.perf_counter() - t0))
+    return results
+
+
+def _extract_task(task):
+    return _extract_pages(*task)
+
+
+def iter_pdf_pages(pdf_docs, max_workers=PDF_WORKERS):
+    """Yield PageText records for every page of every file, in order
+
+    pdf_docs are file-like objects or PdfPath records. Each task carries only
+    its own file, as a path or as bytes, so a worker holds one file at a time.
+    """
+    names = []
+    tasks = []
+    for pdf in pdf_docs:
+        if isinstance(pdf, PdfPath):
+            source, name = pdf.path, pdf.name
+        else:
+            source, name = read_pdf_bytes(pdf), getattr(pdf, 'name', None) or "document.pdf"
+        page_count = len(_open(source).pages)
+        for start in range(0, page_count, PAGES_PER_TASK):
+            tasks.append((len(names), source, start, min(start + PAGES_PER_TASK, page_count)))
+        names.append(name)
+
+    if max_workers <= 1 or len(tasks) <= 1:
+        pool = None
+        results = (_extract_pages(source, start, stop) for _, source, start, stop in tasks)
+    else:
+        pool = ProcessPoolExecutor(max_workers=min(max_workers, len(tasks)), mp_context=MP_CONTEXT)
+        results = pool.map(_extract_task, [task[1:] for task in tasks])
+    try:
+        for (file_index, _, start, _), pages in zip(tasks, results):
+            for offset, (text, seconds) in enumerate(pages):
+                yield PageText(names[file_index], start + offset + 1, text, seconds)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+def slowest_pages(pages, n=5):
+    """The n pages that took longest to extract"""
+    return sorted(pages, key=lambda page: page.seconds, reverse=True)[:n]
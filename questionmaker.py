@@ -1,5 +1,5 @@
-from langchain import LLMChain, PromptTemplate
-from langchain.chat_models import ChatOpenAI
+from langchain.chains import LLMChain
+from langchain_core.prompts import PromptTemplate
 class NoOpLLMChain(LLMChain):
    """No-op LLM chain."""
    def __init__(self, llm):
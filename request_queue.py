@@ -0,0 +1,58 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+REQUEST_WORKERS = int(os.getenv('REQUEST_WORKERS', '16'))
+
+
+class RequestQueue:
+    """Run blocking retrieval + LLM calls on a background asyncio loop
+
+    Streamlit script threads submit work and poll the returned future instead
+    of blocking on the call, so a rerun (or a closed tab) never loses or
+    repeats a request. Submitting a key that is already in flight returns the
+    existing request instead of starting a duplicate.
+    """
+
+    def __init__(self, max_workers=REQUEST_WORKERS):
+        self._loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='request')
+        self._loop.set_default_executor(self._executor)
+        self._thread = threading.Thread(target=self._loop.run_forever, name='request-loop', daemon=True)
+        self._thread.start()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.coalesced = 0
+
+    async def _run(self, fn):
+        return await self._loop.run_in_executor(None, fn)
+
+    def submit(self, key, fn, context=None):
+        """Start fn() unless key is in flight
+
+        Returns (future, context, is_new); for a coalesced request the
+        context is the one given by the caller that started it.
+        """
+        with self._lock:
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                self.coalesced += 1
+                return inflight[0], inflight[1], False
+            future = asyncio.run_coroutine_threadsafe(self._run(fn), self._loop)
+            self._inflight[key] = (future, context)
+            self.submitted += 1
+        future.add_done_callback(functools.partial(self._done, key))
+        return future, context, True
+
+    def _done(self, key, future):
+        with self._lock:
+            if self._inflight.get(key, (None,))[0] is future:
+                del self._inflight[key]
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._inflight)
+        return {'in_flight': in_flight, 'submitted': self.submitted, 'coalesced': self.coalesced}
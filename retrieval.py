@@ -0,0 +1,241 @@
+import logging
+import os
+import pickle
+import threading
+import weakref
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain_core.retrievers import BaseRetriever
+
+from bm25 import BM25Index, citation_terms
+from context_assembly import assemble_context
+
+logger = logging.getLogger(__name__)
+
+# constant from the reciprocal rank fusion paper; damps the weight of top ranks
+RRF_K = 60
+# added to chunks that contain every section number cited in the question
+CITATION_BOOST = 1.0
+# vector hits below this relevance are dropped; tuned on ada-002 scores
+SCORE_THRESHOLD = 0.42
+# the local hashing backend scores matching chunks around 0 and unrelated ones
+# around -0.5, so it keeps the top k instead; RETRIEVAL_SCORE_THRESHOLD in the
+# environment overrides every backend
+SCORE_THRESHOLDS = {'local-hashing-384': None}
+
+# BM25 index saved next to index.faiss and index.pkl
+KEYWORD_INDEX_NAME = 'keywords.pkl'
+
+_keyword_indexes = weakref.WeakKeyDictionary()
+# one build lock per store, so a large index does not hold up searches of others
+_keyword_locks = weakref.WeakKeyDictionary()
+# guards the two maps above
+_keyword_lock = threading.Lock()
+
+
+class ContextDocuments(list):
+    """Retrieved Documents, with assemble_context's stats on how they were packed
+
+    Retrievers hand the same list to on_retriever_end, so callback handlers
+    such as StreamHandler can read the stats.
+    """
+
+    def __init__(self, docs, stats):
+        super().__init__(docs)
+        self.stats = stats
+
+
+def score_threshold_for(embedding_identity):
+    if os.getenv('RETRIEVAL_SCORE_THRESHOLD'):
+        return float(os.getenv('RETRIEVAL_SCORE_THRESHOLD'))
+    return SCORE_THRESHOLDS.get(embedding_identity, SCORE_THRESHOLD)
+
+
+def _store_docs(vectorstore):
+    return [vectorstore.docstore.search(vectorstore.index_to_docstore_id[i])
+            for i in range(len(vectorstore.index_to_docstore_id))]
+
+
+def _cached_keyword_index(vectorstore):
+    with _keyword_lock:
+        cached = _keyword_indexes.get(vectorstore)
+    if cached is not None and cached[0] == vectorstore.index.ntotal:
+        return cached[1], cached[2]
+    return None
+
+
+def _set_keyword_index(vectorstore, index, docs):
+    with _keyword_lock:
+        _keyword_indexes[vectorstore] = (vectorstore.index.ntotal, index, docs)
+
+
+def keyword_index(vectorstore):
+    """BM25 index over a FAISS store's chunks, loaded with the store or built once per store and size"""
+    cached = _cached_keyword_index(vectorstore)
+    if cached is not None:
+        return cached
+    with _keyword_lock:
+        lock = _keyword_locks.setdefault(vectorstore, threading.Lock())
+    with lock:
+        cached = _cached_keyword_index(vectorstore)
+        if cached is not None:
+            return cached
+        docs = _store_docs(vectorstore)
+        index = BM25Index([doc.page_content for doc in docs])
+        _set_keyword_index(vectorstore, index, docs)
+        return index, docs
+
+
+def save_keyword_index(vectorstore, folder):
+    """Build the store's BM25 index afresh and write it into folder
+
+    Always rebuilt, as an edited store can keep its size.
+    """
+    docs = _store_docs(vectorstore)
+    index = BM25Index([doc.page_content for doc in docs])
+    _set_keyword_index(vectorstore, index, docs)
+    with open(os.path.join(folder, KEYWORD_INDEX_NAME), 'wb') as f:
+        pickle.dump((vectorstore.index.ntotal, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_keyword_index(vectorstore, folder):
+    """Attach the BM25 index saved in folder, if there is one for this many chunks"""
+    path = os.path.join(folder, KEYWORD_INDEX_NAME)
+    if not os.path.exists(path):
+        return False
+    with open(path, 'rb') as f:
+        ntotal, index = pickle.load(f)
+    if ntotal != vectorstore.index.ntotal:
+        return False
+    _set_keyword_index(vectorstore, index, _store_docs(vectorstore))
+    return True
+
+
+class MergedRetriever(BaseRetriever):
+    """Search several FAISS indexes with one query embedding and merge the hits
+
+    Used to layer a session's uploaded documents over the shared corpus index.
+    The indexes are only read, never modified. With hybrid set, each index is
+    also searched with BM25 and the rankings are combined by reciprocal rank
+    fusion; chunks containing every section number cited in the question
+    (e.g. "300.322") are put first. With a token_budget the merged hits are
+    de-duplicated and packed into that many tokens of context.
+
+    With a cache (retrieval_cache.RetrievalCache), query embeddings are
+    shared across sessions, and so are results when cache_namespace names
+    the indexes searched (e.g. their version).
+    """
+
+    vectorstores: List[Any]
+    embeddings: Any
+    k: int = 30
+    score_threshold: Optional[float] = SCORE_THRESHOLD
+    hybrid: bool = True
+    token_budget: Optional[int] = None
+    model_name: str = "gpt-3.5-turbo"
+    cache: Any = None
+    cache_namespace: Any = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _vector_rankings(self, embeddings):
+        """Scored vector hits for each of several query embeddings, one FAISS search per index"""
+        import faiss
+
+        vectors = np.array(embeddings, dtype=np.float32)
+        rankings = [[] for _ in range(len(vectors))]
+        for vectorstore in self.vectorstores:
+            if vectorstore.index.d != vectors.shape[1]:
+                raise ValueError(f"query embedding has {vectors.shape[1]} dimensions, "
+                                 f"index expects {vectorstore.index.d}")
+            queries = vectors
+            if vectorstore._normalize_L2:
+                queries = vectors.copy()
+                faiss.normalize_L2(queries)
+            relevance_fn = vectorstore._select_relevance_score_fn()
+            distances, ids = vectorstore.index.search(queries, self.k)
+            for scored, row_distances, row_ids in zip(rankings, distances, ids):
+                for distance, i in zip(row_distances, row_ids):
+                    # -1 pads rows when the index holds fewer than k vectors
+                    if i == -1:
+                        continue
+                    relevance = relevance_fn(distance)
+                    if self.score_threshold is None or relevance >= self.score_threshold:
+                        scored.append((relevance, vectorstore.docstore.search(vectorstore.index_to_docstore_id[i])))
+        for scored in rankings:
+            scored.sort(key=lambda pair: pair[0], reverse=True)
+            del scored[self.k:]
+        return rankings
+
+    def _embed_query(self, query):
+        if self.cache is not None:
+            return self.cache.embed_query(self.embeddings, query)
+        return self.embeddings.embed_query(query)
+
+    def _embed_queries(self, queries):
+        if self.cache is not None:
+            return self.cache.embed_queries(self.embeddings, queries)
+        # the wrapped model, so questions stay out of the chunk embedding cache
+        return getattr(self.embeddings, 'embeddings', self.embeddings).embed_documents(list(queries))
+
+    def _vector_ranking(self, query):
+        return self._vector_rankings([self._embed_query(query)])[0]
+
+    def _hybrid_ranking(self, query, vector_ranking=None):
+        fused = {}
+        docs = {}
+
+        def add(ranking):
+            for rank, doc in enumerate(ranking):
+                docs[id(doc)] = doc
+                fused[id(doc)] = fused.get(id(doc), 0.0) + 1.0 / (RRF_K + rank + 1)
+
+        if vector_ranking is None:
+            vector_ranking = self._vector_ranking(query)
+        add([doc for _, doc in vector_ranking])
+        citations = citation_terms(query)
+        for vectorstore in self.vectorstores:
+            index, store_docs = keyword_index(vectorstore)
+            add([store_docs[doc_id] for doc_id, _ in index.search(query, self.k)])
+            if citations:
+                # exact section lookup straight from the postings lists
+                matches = set(index.containing(citations[0]))
+                for term in citations[1:]:
+                    matches &= set(index.containing(term))
+                for doc_id in matches:
+                    doc = store_docs[doc_id]
+                    docs[id(doc)] = doc
+                    fused[id(doc)] = fused.get(id(doc), 0.0) + CITATION_BOOST
+        ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:self.k]
+        return [(score, docs[key]) for key, score in ranked]
+
+    def _select(self, scored):
+        if self.token_budget is None:
+            return [doc for _, doc in scored]
+        docs, stats = assemble_context(scored, self.token_budget, self.model_name)
+        logger.info("context: kept %(kept)d of %(retrieved)d chunks, %(context_tokens)d tokens "
+                    "(%(tokens_saved)d saved)", stats)
+        return ContextDocuments(docs, stats)
+
+    def _retrieve(self, query):
+        return self._select(self._hybrid_ranking(query) if self.hybrid else self._vector_ranking(query))
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        if self.cache is None or self.cache_namespace is None:
+            return self._retrieve(query)
+        settings = (self.k, self.score_threshold, self.hybrid, self.token_budget, self.model_name)
+        return self.cache.retrieve((self.cache_namespace, settings), query, lambda: self._retrieve(query))
+
+    def retrieve_many(self, queries):
+        """Documents for each query, embedding them in one call and searching each index once
+
+        Used by batch mode; gives the same results as retrieving one query at a time.
+        """
+        if not queries:
+            return []
+        rankings = self._vector_rankings(self._embed_queries(queries))
+        if self.hybrid:
+            rankings = [self._hybrid_ranking(query, ranking) for query, ranking in zip(queries, rankings)]
+        return [self._select(scored) for scored in rankings]
@@ -0,0 +1,127 @@
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from answer_cache import normalize_question
+
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv('RETRIEVAL_CACHE_MAX_ENTRIES', '4096'))
+
+
+class LRU:
+    """Thread-safe least-recently-used map; values are computed outside the lock"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RetrievalCache:
+    """Process-wide cache of query embeddings and retrieval results
+
+    Follow-up questions go to the retriever as asked, so rephrasings and
+    repeats of earlier questions cost a query embedding call and a search
+    each. Embeddings are keyed on (embedding model, normalized question), so
+    they are shared by every index and by the answer cache's lookup; results
+    are keyed on (index version, retrieval settings, normalized question) and
+    shared by sessions searching the same indexes. The time spent on
+    embedding calls is measured, and each hit is credited with the mean.
+    """
+
+    def __init__(self, max_entries=RETRIEVAL_CACHE_MAX_ENTRIES):
+        self.embeddings = LRU(max_entries)
+        self.results = LRU(max_entries)
+        self.embed_calls = 0
+        self.embed_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def embed_query(self, embeddings, question):
+        """The embedding of the normalized question, from the cache or embeddings.embed_query"""
+        text = normalize_question(question)
+        key = (getattr(embeddings, 'model_name', type(embeddings).__name__), text)
+        hit, vector = self.embeddings.get(key)
+        if hit:
+            return vector
+        t0 = time.perf_counter()
+        vector = embeddings.embed_query(text)
+        with self._lock:
+            self.embed_calls += 1
+            self.embed_seconds += time.perf_counter() - t0
+        self.embeddings.put(key, vector)
+        return vector
+
+    def embed_queries(self, embeddings, questions):
+        """embed_query for each question, embedding every uncached one in a single call
+
+        The misses go to the model embeddings wraps, if any, so questions stay
+        out of the persistent chunk embedding cache.
+        """
+        model_name = getattr(embeddings, 'model_name', type(embeddings).__name__)
+        texts = [normalize_question(question) for question in questions]
+        vectors = {}
+        misses = []
+        for text in dict.fromkeys(texts):
+            hit, vector = self.embeddings.get((model_name, text))
+            if hit:
+                vectors[text] = vector
+            else:
+                misses.append(text)
+        if misses:
+            t0 = time.perf_counter()
+            embedded = getattr(embeddings, 'embeddings', embeddings).embed_documents(misses)
+            with self._lock:
+                self.embed_calls += 1
+                self.embed_seconds += time.perf_counter() - t0
+            for text, vector in zip(misses, embedded):
+                vectors[text] = vector
+                self.embeddings.put((model_name, text), vector)
+        return [vectors[text] for text in texts]
+
+    def retrieve(self, namespace, question, retrieve):
+        """retrieve() for the question, or its cached result in namespace"""
+        key = (namespace, normalize_question(question))
+        hit, docs = self.results.get(key)
+        if not hit:
+            docs = retrieve()
+            self.results.put(key, docs)
+        # a shallow copy keeps the list type and its context stats
+        return copy.copy(docs)
+
+    def stats(self):
+        with self._lock:
+            calls, seconds = self.embed_calls, self.embed_seconds
+        mean = seconds / calls if calls else 0.0
+        return {
+            'embedding_hits': self.embeddings.hits,
+            'embedding_misses': self.embeddings.misses,
+            'result_hits': self.results.hits,
+            'result_misses': self.results.misses,
+            'entries': len(self.embeddings) + len(self.results),
+            'embed_calls': calls,
+            'mean_embed_seconds': mean,
+            # a result hit skips its embedding lookup altogether
+            'embed_seconds_saved': mean * (self.embeddings.hits + self.results.hits),
+        }
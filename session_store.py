@@ -0,0 +1,186 @@
+"""Per-session state kept out of st.session_state
+
+Streamlit holds every connected session's st.session_state in memory for as
+long as the tab is open, idle or not. To fit more users per process, session
+state only keeps compact handles (session id, index key, the newest page of
+chat) and the bulky parts live here:
+
+- ChatLog: every message of every session in SQLite; sessions keep only the
+  tail in memory and read older pages on request.
+- SessionStore: the session's conversation chain and memory, dropped after
+  SESSION_IDLE_SECONDS without a rerun and rebuilt from the chat log on the
+  session's next rerun.
+
+Uploaded indexes are spilled to the on-disk index cache (index_cache) and
+loaded into a small shared LRU by key.
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+import types
+
+SESSION_IDLE_SECONDS = float(os.getenv('SESSION_IDLE_SECONDS', '1800'))
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.sessions.sqlite'))
+# chat logs of sessions idle this long are deleted
+CHAT_LOG_RETENTION_DAYS = float(os.getenv('CHAT_LOG_RETENTION_DAYS', '7'))
+
+
+def approx_size(obj, exclude=()):
+    """Rough bytes held by obj and everything it references, minus exclude
+
+    FAISS vectors live in C++ and are invisible to getsizeof, so LangChain
+    FAISS stores are counted as ntotal * dim float32s plus their docstore.
+    """
+    seen = {id(o) for o in exclude}
+    stack = [obj]
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, types.ModuleType, types.FunctionType, types.MethodType)):
+            continue
+        seen.add(id(obj))
+        index = obj.__dict__.get('index') if hasattr(obj, '__dict__') else None
+        if hasattr(index, 'ntotal') and hasattr(index, 'd'):
+            total += index.ntotal * index.d * 4
+            stack.append(obj.__dict__.get('docstore'))
+            continue
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            stack.append(vars(obj))
+    return total
+
+
+class ChatLog:
+    """Append-only chat history per session in SQLite"""
+
+    def __init__(self, path=SESSION_DB_PATH):
+        self.path = path
+        self._pruned = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("CREATE TABLE IF NOT EXISTS messages ("
+                     "session_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, "
+                     "content TEXT NOT NULL, created REAL NOT NULL, PRIMARY KEY (session_id, seq))")
+        return conn
+
+    def append(self, session_id, messages):
+        conn = self._connect()
+        try:
+            (count,) = conn.execute("SELECT COUNT(*) FROM messages WHERE session_id = ?", [session_id]).fetchone()
+            now = time.time()
+            conn.executemany("INSERT INTO messages VALUES (?, ?, ?, ?, ?)",
+                             [(session_id, count + i, m['role'], m['content'], now) for i, m in enumerate(messages)])
+            # drop logs of long-gone sessions, at most hourly
+            if now - self._pruned > 3600:
+                conn.execute("DELETE FROM messages WHERE session_id IN (SELECT session_id FROM messages "
+                             "GROUP BY session_id HAVING MAX(created) < ?)",
+                             [now - CHAT_LOG_RETENTION_DAYS * 86400])
+                self._pruned = now
+            conn.commit()
+        finally:
+            conn.close()
+
+    def tail(self, session_id, n):
+        """The newest n messages, oldest first"""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT role, content FROM messages WHERE session_id = ? "
+                                "ORDER BY seq DESC LIMIT ?", [session_id, n]).fetchall()
+        finally:
+            conn.close()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+    def clear(self, session_id):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", [session_id])
+            conn.commit()
+        finally:
+            conn.close()
+
+
+class SessionStore:
+    """Heavy per-session objects, evicted once a session goes idle"""
+
+    def __init__(self, idle_seconds=SESSION_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self.evicted = 0
+        self._sessions = {}
+        self._shared = {}
+        self._lock = threading.Lock()
+
+    def mark_shared(self, *objs):
+        """Leave process-wide objects (shared index, models) out of per-session sizes"""
+        with self._lock:
+            for obj in objs:
+                if obj is not None:
+                    self._shared[id(obj)] = obj
+
+    def objects(self, session_id):
+        """The session's dict of objects, marking it active; empty after eviction"""
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = self._sessions[session_id] = {'objects': {}}
+            entry['last_seen'] = now
+            return entry['objects']
+
+    def evict_idle(self):
+        now = time.time()
+        with self._lock:
+            idle = [sid for sid, entry in self._sessions.items() if now - entry['last_seen'] > self.idle_seconds]
+            for session_id in idle:
+                del self._sessions[session_id]
+            self.evicted += len(idle)
+        return len(idle)
+
+    def sizes(self, session_id):
+        """Approximate bytes per object of one session, not counting shared objects"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            objects = dict(entry['objects']) if entry else {}
+            shared = list(self._shared.values())
+        return {name: approx_size(obj, shared) for name, obj in objects.items()}
+
+    def report(self):
+        """One row per live session: idle seconds and approximate bytes per object"""
+        now = time.time()
+        with self._lock:
+            sessions = [(sid, entry['last_seen']) for sid, entry in self._sessions.items()]
+        rows = []
+        for session_id, last_seen in sessions:
+            sizes = self.sizes(session_id)
+            rows.append({'session': session_id[:8], 'idle_seconds': round(now - last_seen),
+                         'bytes': sum(sizes.values()), **sizes})
+        return sorted(rows, key=lambda row: row['bytes'], reverse=True)
+
+
+_store = None
+_chat_log = None
+_lock = threading.Lock()
+
+
+def get_session_store():
+    """The process-wide SessionStore, shared by the app and the admin pages"""
+    global _store
+    with _lock:
+        if _store is None:
+            _store = SessionStore()
+        return _store
+
+
+def get_chat_log():
+    global _chat_log
+    with _lock:
+        if _chat_log is None:
+            _chat_log = ChatLog()
+        return _chat_log
@@ -0,0 +1,61 @@
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from tokens import count_tokens
+
+
+class StreamHandler(BaseCallbackHandler):
+    """Collect LLM tokens as they arrive, and time the request's stages
+
+    The call runs on a request worker thread, which cannot write to Streamlit
+    elements, so the script thread polls `text` and renders it.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.started_at = time.perf_counter()
+        self.first_token_at = None
+        self.prompt_tokens = 0
+        self.retrieval_started_at = None
+        self.retrieval_seconds = None
+        self.chunks = None
+        self.context_tokens_saved = None
+
+    def on_retriever_start(self, serialized, query, **kwargs):
+        self.retrieval_started_at = time.perf_counter()
+
+    def on_retriever_end(self, documents, **kwargs):
+        if self.retrieval_started_at is not None:
+            self.retrieval_seconds = time.perf_counter() - self.retrieval_started_at
+        self.chunks = len(documents)
+        # set by retrieval.MergedRetriever when it packs the context into a token budget
+        stats = getattr(documents, 'stats', None)
+        if stats is not None:
+            self.context_tokens_saved = stats['tokens_saved']
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.prompt_tokens = sum(count_tokens(message.content) for batch in messages for message in batch)
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.text += token
+
+    @property
+    def time_to_first_token(self):
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+
+    def span(self):
+        """Measurements of the request so far, as recorded by tracing.TraceStore"""
+        return {
+            'retrieval_seconds': self.retrieval_seconds,
+            'chunks': self.chunks,
+            'context_tokens_saved': self.context_tokens_saved,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': count_tokens(self.text) if self.text else 0,
+            'time_to_first_token': self.time_to_first_token,
+            'total_seconds': time.perf_counter() - self.started_at,
+        }
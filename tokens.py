@@ -0,0 +1,25 @@
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # the BPE files are downloaded on first use, which fails offline
+        return None
+
+
+def count_tokens(text, model="gpt-3.5-turbo"):
+    """Token count for text, or a 4-chars-per-token estimate without tiktoken"""
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
@@ -0,0 +1,176 @@
+"""Per-question latency spans in a local SQLite store
+
+Each answered question records how long retrieval took, how many chunks it
+returned, the retrieved tokens cut from the context, prompt and completion
+tokens, time to first token and total time, labelled with the model and
+student type. The Metrics page and `python -m tracing` summarise the recent
+spans as percentiles in the Prometheus text format, e.g. for a node exporter
+textfile collector:
+
+    python -m tracing > /var/lib/node_exporter/chatbot.prom
+"""
+import logging
+import math
+import os
+import sqlite3
+import sys
+import time
+
+TRACE_DB_PATH = os.getenv('TRACE_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.traces.sqlite'))
+# percentiles cover this many recent hours; older spans are deleted after TRACE_RETENTION_DAYS
+TRACE_WINDOW_HOURS = float(os.getenv('TRACE_WINDOW_HOURS', '24'))
+TRACE_RETENTION_DAYS = float(os.getenv('TRACE_RETENTION_DAYS', '30'))
+QUANTILES = (0.5, 0.9, 0.99)
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ['started', 'model', 'student_type', 'status', 'cached', 'error', 'retrieval_seconds', 'chunks',
+           'context_tokens_saved', 'prompt_tokens', 'completion_tokens', 'time_to_first_token', 'total_seconds']
+# (span column, metric name, help text) of the per-label summaries
+METRICS = [
+    ('total_seconds', 'chatbot_answer_seconds', "Time from question to complete answer"),
+    ('time_to_first_token', 'chatbot_time_to_first_token_seconds', "Time from question to first streamed token"),
+    ('retrieval_seconds', 'chatbot_retrieval_seconds', "Time spent embedding the question and searching"),
+    ('chunks', 'chatbot_retrieved_chunks', "Chunks sent to the model as context"),
+    ('context_tokens_saved', 'chatbot_context_tokens_saved',
+     "Retrieved tokens left out of the context as duplicates or over the budget"),
+    ('prompt_tokens', 'chatbot_prompt_tokens', "Tokens in the prompt sent to the model"),
+    ('completion_tokens', 'chatbot_completion_tokens', "Tokens in the model's answer"),
+]
+
+
+def percentile(values, q):
+    """Linearly interpolated q-quantile of sorted values"""
+    if not values:
+        return None
+    position = (len(values) - 1) * q
+    lower, upper = math.floor(position), math.ceil(position)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+
+
+class TraceStore:
+    def __init__(self, path=TRACE_DB_PATH):
+        self.path = path
+        self._pruned = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("CREATE TABLE IF NOT EXISTS spans ("
+                     "started REAL NOT NULL, model TEXT, student_type TEXT, status TEXT NOT NULL, "
+                     "cached INTEGER NOT NULL DEFAULT 0, error TEXT, retrieval_seconds REAL, chunks INTEGER, "
+                     "prompt_tokens INTEGER, completion_tokens INTEGER, time_to_first_token REAL, "
+                     "total_seconds REAL, context_tokens_saved INTEGER)")
+        if 'context_tokens_saved' not in {row[1] for row in conn.execute("PRAGMA table_info(spans)")}:
+            # stores created before the column was added
+            conn.execute("ALTER TABLE spans ADD COLUMN context_tokens_saved INTEGER")
+        conn.execute("CREATE INDEX IF NOT EXISTS spans_started ON spans (started)")
+        return conn
+
+    def record(self, model, student_type, status='ok', cached=False, error=None, **measurements):
+        """Store one span; measurements are the StreamHandler.span() keys
+
+        Tracing must never fail a request, so storage errors are only logged.
+        """
+        span = dict(measurements, model=model, student_type=student_type, status=status,
+                    cached=int(cached), error=error, started=time.time() - measurements.get('total_seconds', 0))
+        try:
+            conn = self._connect()
+            try:
+                conn.execute(f"INSERT INTO spans ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                             [span.get(column) for column in COLUMNS])
+                # prune at most hourly
+                if time.time() - self._pruned > 3600:
+                    conn.execute("DELETE FROM spans WHERE started < ?", [time.time() - TRACE_RETENTION_DAYS * 86400])
+                    self._pruned = time.time()
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning("could not record trace span: %s", e)
+
+    def spans(self, hours=TRACE_WINDOW_HOURS):
+        """Spans started in the last `hours`, oldest first, as dicts"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM spans WHERE started >= ? ORDER BY started",
+                                [time.time() - hours * 3600]).fetchall()
+        finally:
+            conn.close()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def summary(self, hours=TRACE_WINDOW_HOURS):
+        """{(model, student_type): {column: {'count', 'sum', quantile: value}}} over answered, uncached spans"""
+        grouped = {}
+        for span in self.spans(hours):
+            if span['status'] != 'ok' or span['cached']:
+                continue
+            group = grouped.setdefault((span['model'], span['student_type']), {})
+            for column, _, _ in METRICS:
+                if span[column] is not None:
+                    group.setdefault(column, []).append(span[column])
+        summary = {}
+        for key, columns in grouped.items():
+            summary[key] = {}
+            for column, values in columns.items():
+                values.sort()
+                stats = {'count': len(values), 'sum': sum(values)}
+                stats.update((q, percentile(values, q)) for q in QUANTILES)
+                summary[key][column] = stats
+        return summary
+
+    def prometheus_text(self, hours=TRACE_WINDOW_HOURS):
+        """Request counts and per-label latency summaries in the Prometheus text format"""
+        spans = self.spans(hours)
+        counts = {}
+        for span in spans:
+            key = (span['model'], span['student_type'], span['status'], 'cache' if span['cached'] else 'llm')
+            counts[key] = counts.get(key, 0) + 1
+        lines = ["# HELP chatbot_requests Questions answered in the window, by outcome",
+                 "# TYPE chatbot_requests gauge"]
+        for (model, student_type, status, source), count in sorted(counts.items()):
+            labels = _labels(model=model, student_type=student_type, status=status, source=source)
+            lines.append(f"chatbot_requests{{{labels}}} {count}")
+        summary = self.summary(hours)
+        for column, metric, help_text in METRICS:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} summary")
+            for (model, student_type), columns in sorted(summary.items()):
+                stats = columns.get(column)
+                if stats is None:
+                    continue
+                labels = _labels(model=model, student_type=student_type)
+                for q in QUANTILES:
+                    lines.append(f'{metric}{{{labels},quantile="{q}"}} {stats[q]:.6g}')
+                lines.append(f"{metric}_sum{{{labels}}} {stats['sum']:.6g}")
+                lines.append(f"{metric}_count{{{labels}}} {stats['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def traced(store, handler, fn, model, student_type):
+    """Wrap fn so its span is recorded when it finishes, whether or not anyone is still waiting"""
+    def run():
+        try:
+            result = fn()
+        except Exception as e:
+            store.record(model, student_type, status='error', error=type(e).__name__, **handler.span())
+            raise
+        store.record(model, student_type, **handler.span())
+        return result
+    return run
+
+
+def main():
+    sys.stdout.write(TraceStore().prometheus_text())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())